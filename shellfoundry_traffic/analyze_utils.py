@@ -0,0 +1,134 @@
+"""
+Shellfoundry traffic package analysis utilities.
+
+Explain why a shell or script package is big - entries by raw and compressed size, compression ratio, duplicated content,
+files that the definition exclude rules (or common exclude rules) would drop and build time per stage. Nested zips
+(shell driver) are analyzed too.
+
+The report is written as json next to the package (dist/<package name>.analysis.json), so CI can enforce size budgets.
+"""
+import hashlib
+import json
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from zipfile import ZipFile
+
+from shellfoundry_traffic.exclude_utils import ExcludeMatcher
+
+# Files that are rarely needed at run time, reported as droppable when the definition has no exclude rules.
+SUGGESTED_EXCLUDES = [
+    "tests/",
+    "test_*.py",
+    "*_test.py",
+    "conftest.py",
+    "docs/",
+    "*.md",
+    "*.rst",
+    ".pytest_cache/",
+    ".mypy_cache/",
+    "*.egg-info/",
+    ".DS_Store",
+    "*.log",
+]
+
+
+def analyze_package(
+    package: Path, stages: Optional[Dict[str, float]] = None, excludes: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """Returns analysis report of a package (zip file) and writes it next to the package.
+
+    :param package: Shell or script zip file.
+    :param stages: Build time, in seconds, per stage.
+    :param excludes: Exclude patterns of the package definition (gitignore style), files they match are reported as
+        droppable. If None or empty, SUGGESTED_EXCLUDES are used.
+    """
+    matcher = ExcludeMatcher(excludes or SUGGESTED_EXCLUDES)
+    with ZipFile(package) as package_zip:
+        entries = _entries(package_zip)
+    top_level = [entry for entry in entries if not entry["container"]]
+    size = sum(entry["size"] for entry in top_level)
+    compressed = sum(entry["compressed"] for entry in top_level)
+    by_hash: Dict[str, List[Dict[str, Any]]] = {}
+    for entry in entries:
+        if entry["size"] and not entry["name"].endswith(".zip"):
+            by_hash.setdefault(entry["sha256"], []).append(entry)
+    report = {
+        "package": package.as_posix(),
+        "file_size": package.stat().st_size,
+        "totals": {"entries": len(top_level), "size": size, "compressed": compressed, "ratio": _ratio(compressed, size)},
+        "entries": sorted(entries, key=lambda entry: entry["compressed"], reverse=True),
+        "duplicates": [
+            {"sha256": sha256, "size": same[0]["size"], "names": [_full_name(entry) for entry in same]}
+            for sha256, same in by_hash.items()
+            if len(same) > 1
+        ],
+        "droppable": [_full_name(entry) for entry in entries if _is_excluded(matcher, entry["name"])],
+        "stages": stages or {},
+    }
+    with open(package.with_suffix(".analysis.json"), "w") as file:
+        json.dump(report, file, indent=2)
+    return report
+
+
+def print_report(report: Dict[str, Any], top: int = 10) -> None:
+    """Print terse summary of analysis report - totals, largest entries, duplicates, droppable files and stages."""
+    totals = report["totals"]
+    print(  # noqa: T001
+        f"{report['package']}: {report['file_size'] / 1024:.1f} KB, {totals['entries']} entries, "
+        f"{totals['size'] / 1024:.1f} KB compressed to {totals['compressed'] / 1024:.1f} KB ({totals['ratio']:.0%}), "
+        f"{len(report['duplicates'])} duplicated, {len(report['droppable'])} droppable"
+    )
+    largest = report["entries"][:top]
+    width = max([len("entry")] + [len(_full_name(entry)) for entry in largest])
+    print(f"  {'entry':<{width}}  {'size [KB]':>10}  {'compressed [KB]':>16}  {'ratio':>6}")  # noqa: T001
+    for entry in largest:
+        print(  # noqa: T001
+            f"  {_full_name(entry):<{width}}  {entry['size'] / 1024:>10.1f}  {entry['compressed'] / 1024:>16.1f}  "
+            f"{entry['ratio']:>6.0%}"
+        )
+    for duplicate in report["duplicates"]:
+        print(f"  duplicated ({duplicate['size'] / 1024:.1f} KB): {', '.join(duplicate['names'])}")  # noqa: T001
+    if report["droppable"]:
+        print(f"  droppable: {', '.join(report['droppable'])}")  # noqa: T001
+    if report["stages"]:
+        stages = ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in report["stages"].items())
+        print(f"  stages: {stages}")  # noqa: T001
+
+
+def _entries(package_zip: ZipFile, container: str = "") -> List[Dict[str, Any]]:
+    """Returns entries of the zip and of nested zips, nested entries names are relative to their container."""
+    entries = []
+    for info in package_zip.infolist():
+        if info.is_dir():
+            continue
+        content = package_zip.read(info)
+        entries.append(
+            {
+                "name": info.filename,
+                "container": container,
+                "size": info.file_size,
+                "compressed": info.compress_size,
+                "ratio": _ratio(info.compress_size, info.file_size),
+                "sha256": hashlib.sha256(content).hexdigest(),
+            }
+        )
+        if info.filename.endswith(".zip"):
+            with ZipFile(BytesIO(content)) as nested_zip:
+                entries.extend(_entries(nested_zip, f"{container}{info.filename}/"))
+    return entries
+
+
+def _is_excluded(matcher: Any, name: str) -> bool:
+    """Returns whether the file, or any of its parent directories, is excluded."""
+    parts = name.split("/")
+    folders = ["/".join(parts[:index]) for index in range(1, len(parts))]
+    return any(matcher.match(folder, True) for folder in folders) or matcher.match(name)
+
+
+def _full_name(entry: Dict[str, Any]) -> str:
+    return f"{entry['container']}{entry['name']}"
+
+
+def _ratio(compressed: int, size: int) -> float:
+    return round(compressed / size, 3) if size else 1.0
@@ -0,0 +1,72 @@
+"""
+Shellfoundry traffic exclude utilities.
+
+gitignore style exclude patterns, shared by script zip and package analysis. The module has no dependencies beyond the
+standard library, so importing it does not pull the CloudShell API or pytest.
+"""
+import re
+from typing import List, Pattern, Tuple
+
+
+class ExcludeMatcher:  # pylint: disable=too-few-public-methods
+    """Match paths against gitignore style patterns, compiled once.
+
+    Patterns without a slash (other than a trailing one) match at any level, other patterns are relative to the root.
+    A trailing slash matches directories only, * and ? do not match a slash, ** matches any number of directories,
+    a leading ! re-includes paths excluded by previous patterns (but not files under excluded directories, as they
+    are never walked). Empty lines and lines starting with # are ignored.
+    """
+
+    def __init__(self, patterns: List[str]) -> None:
+        self.patterns: List[Tuple[Pattern, bool, bool]] = []
+        for pattern in patterns:
+            pattern = str(pattern).strip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            negate = pattern.startswith("!")
+            pattern = pattern[1:] if negate else pattern
+            dir_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            anchored = "/" in pattern
+            regex = _glob_regex(pattern.lstrip("/"))
+            self.patterns.append((re.compile(regex if anchored else f"(?:.*/)?{regex}"), negate, dir_only))
+
+    def match(self, path: str, is_dir: bool = False) -> bool:
+        """Returns whether path is excluded.
+
+        :param path: Posix path relative to the root.
+        :param is_dir: Whether path is a directory.
+        """
+        excluded = False
+        for regex, negate, dir_only in self.patterns:
+            if excluded == negate and (is_dir or not dir_only) and regex.fullmatch(path):
+                excluded = not negate
+        return excluded
+
+
+def _glob_regex(pattern: str) -> str:
+    """Translate gitignore style glob pattern to regular expression."""
+    regex = ""
+    index = 0
+    while index < len(pattern):
+        if pattern.startswith("**/", index):
+            regex += "(?:.*/)?"
+            index += 3
+        elif pattern.startswith("**", index):
+            regex += ".*"
+            index += 2
+        elif pattern[index] == "*":
+            regex += "[^/]*"
+            index += 1
+        elif pattern[index] == "?":
+            regex += "[^/]"
+            index += 1
+        elif pattern[index] == "[" and "]" in pattern[index + 2 :]:
+            end = pattern.index("]", index + 2)
+            characters = pattern[index + 1 : end]
+            regex += f"[^{characters[1:]}]" if characters.startswith("!") else f"[{characters}]"
+            index = end + 1
+        else:
+            regex += re.escape(pattern[index])
+            index += 1
+    return regex
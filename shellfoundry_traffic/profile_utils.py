@@ -0,0 +1,198 @@
+"""
+Shellfoundry traffic profiling utilities.
+
+Sub commands wrap their phases (yaml load, manifest, zip, login, upload...) in timing spans. Spans are recorded only when
+profiling is enabled (shellfoundry-traffic --profile), otherwise a span costs a couple of attribute checks.
+Stages of a block can also be recorded locally (record_stages), without enabling the profiler.
+
+Recorded spans are reported as a table and, optionally, as a Chrome trace (chrome://tracing, https://ui.perfetto.dev).
+Optionally, the outermost phases are also profiled with cProfile, one dump per phase (python -m pstats <dump>).
+"""
+import cProfile
+import json
+import os
+import re
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock, get_ident, local
+from typing import ContextManager, Dict, Iterator, List, NamedTuple, Optional
+
+
+class Span(NamedTuple):
+    """Single timed phase."""
+
+    name: str
+    start: float
+    seconds: float
+    depth: int
+    process_id: int
+    thread_id: int
+
+
+class Profiler:
+    """Record timing spans of all threads, disabled until enabled."""
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.profile_dir: Optional[Path] = None
+        self.spans: List[Span] = []
+        self._lock = Lock()
+        self._local = local()
+        self._profiling = False
+        self._dumps = 0
+
+    def enable(self, profile_dir: Optional[str] = None) -> None:
+        """Start recording spans.
+
+        :param profile_dir: If set, profile the outermost phases with cProfile and dump the stats under this folder.
+        """
+        self.enabled = True
+        if profile_dir:
+            self.profile_dir = Path(profile_dir)
+            self.profile_dir.mkdir(parents=True, exist_ok=True)
+
+    def disable(self) -> None:
+        """Stop recording spans and discard recorded spans."""
+        self.enabled = False
+        self.profile_dir = None
+        self.collect()
+
+    @contextmanager
+    def span(self, name: str, profile: bool = True) -> Iterator[None]:
+        """Time the enclosed block as phase name, no-op when profiling is disabled.
+
+        :param name: Phase name, spans with the same name are aggregated in the table.
+        :param profile: If False, never profile the block with cProfile (so nested phases get their own dumps).
+        """
+        recorders: List[Dict[str, float]] = getattr(self._local, "recorders", [])
+        if not self.enabled and not recorders:
+            yield
+            return
+        enabled = self.enabled
+        for stages in recorders:
+            stages.setdefault(name, 0.0)
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        profiler = self._start_profile() if profile and enabled else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self._local.depth = depth
+            if profiler:
+                self._dump_profile(profiler, name)
+            for stages in recorders:
+                stages[name] += seconds
+            if enabled:
+                with self._lock:
+                    self.spans.append(Span(name, start, seconds, depth, os.getpid(), get_ident()))
+
+    @contextmanager
+    def record(self) -> Iterator[Dict[str, float]]:
+        """Yields dict filled with total seconds per phase of the enclosed block, recorded in the current thread only.
+
+        Stages are collected locally, whether the profiler is enabled or not, and the profiler state is not modified,
+        so concurrent threads can record their own stages.
+        """
+        stages: Dict[str, float] = {}
+        recorders = getattr(self._local, "recorders", [])
+        self._local.recorders = recorders + [stages]
+        try:
+            yield stages
+        finally:
+            self._local.recorders = recorders
+            stages.update((name, round(seconds, 6)) for name, seconds in stages.items())
+
+    def collect(self) -> List[Span]:
+        """Returns and clears recorded spans (used to pass spans from worker processes to the main process)."""
+        with self._lock:
+            spans, self.spans = self.spans, []
+        return spans
+
+    def add(self, spans: List[Span]) -> None:
+        """Add spans recorded by another process."""
+        with self._lock:
+            self.spans.extend(spans)
+
+    def print_table(self) -> None:
+        """Print calls and total, mean and max time per phase, in order of first call, nested phases indented."""
+        phases: Dict[str, List[Span]] = {}
+        for recorded in sorted(self.spans, key=lambda recorded: recorded.start):
+            phases.setdefault(recorded.name, []).append(recorded)
+        titles = {name: "  " * min(recorded.depth for recorded in spans) + name for name, spans in phases.items()}
+        width = max([len("phase")] + [len(title) for title in titles.values()])
+        print(f"{'phase':<{width}}  {'calls':>6}  {'total [s]':>10}  {'mean [s]':>9}  {'max [s]':>8}")  # noqa: T001
+        for name, spans in phases.items():
+            total = sum(recorded.seconds for recorded in spans)
+            print(  # noqa: T001
+                f"{titles[name]:<{width}}  {len(spans):>6}  {total:>10.3f}  {total / len(spans):>9.3f}  "
+                f"{max(recorded.seconds for recorded in spans):>8.3f}"
+            )
+
+    def write_trace(self, trace_json: str) -> None:
+        """Write recorded spans as Chrome trace (trace event format) json file."""
+        origin = min((recorded.start for recorded in self.spans), default=0)
+        events = [
+            {
+                "name": recorded.name,
+                "cat": "shellfoundry-traffic",
+                "ph": "X",
+                "ts": round((recorded.start - origin) * 1_000_000),
+                "dur": round(recorded.seconds * 1_000_000),
+                "pid": recorded.process_id,
+                "tid": recorded.thread_id,
+            }
+            for recorded in self.spans
+        ]
+        with open(trace_json, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+    def _start_profile(self) -> Optional[cProfile.Profile]:
+        """Start cProfile, unless dumps are not requested or another phase (in any thread) is already profiled."""
+        if not self.profile_dir:
+            return None
+        with self._lock:
+            if self._profiling:
+                return None
+            self._profiling = True
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger or coverage) is active.
+            with self._lock:
+                self._profiling = False
+            return None
+        return profile
+
+    def _dump_profile(self, profile: cProfile.Profile, name: str) -> None:
+        profile.disable()
+        with self._lock:
+            self._dumps += 1
+            file_name = re.sub(r"[^\w.-]", "_", name)
+            dump = self.profile_dir.joinpath(f"{os.getpid()}-{self._dumps:03d}-{file_name}.prof")
+            self._profiling = False
+        profile.dump_stats(dump)
+
+
+PROFILER = Profiler()
+
+
+def span(name: str, profile: bool = True) -> ContextManager[None]:
+    """Time the enclosed block as phase name of the global profiler (see Profiler.span)."""
+    return PROFILER.span(name, profile)
+
+
+def enable(profile_dir: Optional[str] = None) -> None:
+    """Enable the global profiler (see Profiler.enable), also used as worker processes initializer."""
+    PROFILER.enable(profile_dir)
+
+
+def record_stages() -> ContextManager[Dict[str, float]]:
+    """Yields dict filled with total seconds per phase of the enclosed block, in the current thread (see Profiler.record).
+
+    The global profiler is neither enabled nor disabled, so stages can be recorded concurrently with other threads.
+    """
+    return PROFILER.record()
@@ -4,58 +4,321 @@ Shellfoundry traffic script utilities.
 NOTE: - This script is only for updating EXISTING scripts.
       - Scripts MUST be uploaded manually first time (this tool can still be used to do zipping).
 
+Script zips are reproducible (fixed timestamps and permissions, sorted entries), so the same sources always give the same
+zip. The content hash of the last zip uploaded to each server is kept in dist/script_uploads.json, so unchanged scripts
+are not uploaded (and the session is not even created) again.
+
+A script definition defines a single script (metadata.script_name and files), or multiple scripts (a scripts list, each
+with its own script_name and files, where files are merged with the top level files):
+
+metadata:
+  template_author: ...
+files:
+  exclude: [tests/]
+scripts:
+  - script_name: Setup
+    files:
+      main: setup.py
+  - script_name: Teardown
+    files:
+      main: teardown.py
+      exclude: [setup_data/]
+
+Optionally, src/requirements.txt dependencies are vendored into the script zip - installed from a local wheelhouse into a
+dependency layer (dist/dependencies/<layer key>) that is reused until the requirements, the wheelhouse content, the
+python version or the platform change.
+
 :todo: move the class into shellfoundry_traffic_cmd.py and delete the module?
 """
+import base64
+import hashlib
+import json
 import os
+import subprocess
+import sys
+import sysconfig
+import time
+from collections import OrderedDict
 from pathlib import Path
-from shutil import copyfile
-from zipfile import ZipFile
+from shutil import copyfileobj, rmtree
+from tempfile import mkdtemp
+from threading import Lock
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from zipfile import ZIP_DEFLATED, ZipFile, ZipInfo
 
+import urllib3
 import yaml
+from cloudshell.api.cloudshell_api import CloudShellAPISession
 
+from shellfoundry_traffic.exclude_utils import ExcludeMatcher
+from shellfoundry_traffic.profile_utils import span
+from shellfoundry_traffic.shell_utils import file_hash
 from shellfoundry_traffic.test_helpers import create_session_from_config
 
-SRC_DIR = Path(os.getcwd()).joinpath("src")
+SRC_FOLDER = "src"
+DEFAULT_EXCLUDES = ["__pycache__/", "*.pyc", ".venv/", ".git/"]
+UPLOAD_LEDGER = "script_uploads.json"
+REQUIREMENTS_TXT = "requirements.txt"
+MAIN_PY = "__main__.py"
+UPLOAD_RETRIES = 3
+UPLOAD_BACKOFF = 0.5
+UPLOAD_MAX_BACKOFF = 8.0
+# Network errors are retried, CloudShell API errors (e.g. script not found) are not. The API client sends requests with
+# urllib3, so dropped connections are raised as urllib3 errors (ProtocolError) that are not OSError.
+TRANSIENT_ERRORS = (OSError, urllib3.exceptions.HTTPError)
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+_ledger_lock = Lock()
 
 
 class ScriptCommandExecutor:
     """Shellfoundry traffic script sub command executor."""
 
-    def __init__(self, script_definition: str) -> None:
-        script_definition_yaml = script_definition if script_definition.endswith(".yaml") else f"{script_definition}.yaml"
-        script_definition_yaml_full_path = Path(os.getcwd()).joinpath(script_definition_yaml)
-        with open(script_definition_yaml_full_path, "r") as file:
-            self.script_definition = yaml.safe_load(file)
+    def __init__(
+        self, script_definition: str, script_name: Optional[str] = None, src_dir: Optional[Union[str, Path]] = None
+    ) -> None:
+        """Load script definition.
+
+        :param script_definition: Script definition yaml file.
+        :param script_name: Script to build from a multiple scripts definition, may be None if only one script is defined.
+        :param src_dir: Script sources folder, default is src under the current directory.
+        """
+        self.script_definition = _select_script(_load_script_definition(script_definition), script_name)
+        self.src_dir = Path(src_dir) if src_dir else Path(os.getcwd()).joinpath(SRC_FOLDER)
         self.dist = Path(os.getcwd()).joinpath("dist")
         self.script_zip = self.dist.joinpath(f'{self.script_definition["metadata"]["script_name"]}.zip')
+        excludes = (self.script_definition.get("files") or {}).get("exclude") or []
+        self.excludes = ExcludeMatcher(DEFAULT_EXCLUDES + excludes)
+        self.upload_seconds = 0.0
+        self.upload_attempts = 0
+
+    def get_main(self) -> Optional[Path]:
+        """Returns the module selected by files.main, zipped as __main__.py, None if the script uses src/__main__.py.
+
+        The source tree is not modified, so multiple variants of a script can be built concurrently.
+        """
+        main = (self.script_definition.get("files") or {}).get("main")
+        return self.src_dir.joinpath(main) if main else None
+
+    def should_zip(self, file: str, is_dir: bool = False) -> bool:
+        """Returns whether the file (or directory), relative to src, should be added to the script zip file or not."""
+        return not self.excludes.match(Path(file).as_posix(), is_dir)
+
+    def zip_files(self, wheelhouse: Optional[str] = None) -> None:
+        """Zip files for upload, in a single pass, keeping their path relative to src.
+
+        Excluded directories are pruned, so they are never walked. Entries are written in sorted order, with fixed
+        timestamps and permissions, so the zip content depends only on the zipped files content.
+
+        :param wheelhouse: Folder with wheels to vendor src/requirements.txt from, default is files.wheelhouse of the
+            script definition. If set, the dependencies are zipped with the sources (source files win on conflict) and
+            requirements.txt is not zipped, so the Execution Server does not resolve the dependencies again.
+        """
+        wheelhouse = wheelhouse or (self.script_definition.get("files") or {}).get("wheelhouse")
+        layer = None
+        if wheelhouse and self.src_dir.joinpath(REQUIREMENTS_TXT).exists():
+            with span("vendor dependencies"):
+                layer = vendor_dependencies(
+                    self.src_dir.joinpath(REQUIREMENTS_TXT), Path(wheelhouse), self.dist.joinpath("dependencies")
+                )
+        main = self.get_main()
+        self.dist.mkdir(parents=True, exist_ok=True)
+        with ZipFile(self.script_zip, "w", ZIP_DEFLATED) as script:
+            for source, arcname in self._walk(self.src_dir, self.excludes):
+                if not (layer and arcname == REQUIREMENTS_TXT):
+                    _write_reproducible(script, main if main and arcname == MAIN_PY else source, arcname)
+            if main and MAIN_PY not in script.namelist():
+                _write_reproducible(script, main, MAIN_PY)
+            if layer:
+                zipped = set(script.namelist())
+                for source, arcname in self._walk(layer, ExcludeMatcher(DEFAULT_EXCLUDES)):
+                    if arcname not in zipped:
+                        _write_reproducible(script, source, arcname)
+
+    @staticmethod
+    def _walk(folder: Path, excludes: ExcludeMatcher) -> Iterator[Tuple[Path, str]]:
+        """Yields files under folder, and their path relative to folder, in sorted order, pruning excluded directories."""
+        for root, dirs, files in os.walk(folder):
+            relative_root = Path(root).relative_to(folder)
+            dirs[:] = sorted(
+                sub_dir for sub_dir in dirs if not excludes.match(relative_root.joinpath(sub_dir).as_posix(), True)
+            )
+            for file in sorted(files):
+                arcname = relative_root.joinpath(file).as_posix()
+                if not excludes.match(arcname):
+                    yield Path(root).joinpath(file), arcname
+
+    def update_script(self, session: Optional[CloudShellAPISession] = None, force: bool = False) -> bool:
+        """Update script name in metadata to zip file name.
+
+        The upload is skipped if the same zip content was already uploaded to the server (see upload ledger).
+
+        :param session: Session to upload with, if None create new session from shellfoundry config (only if the upload
+            is not skipped).
+        :param force: If True, upload even if the same zip content was already uploaded.
+        :return: False if the upload was skipped, else True.
+        """
+        if not force and self.is_uploaded(session):
+            return False
+        script_name = self.script_definition["metadata"]["script_name"]
+        session = session or create_session_from_config()
+        self.upload_seconds, self.upload_attempts = upload_script(session, script_name, self.script_zip)
+        _update_ledger(self.dist, f"{_server_id(session)}/{script_name}", file_hash(self.script_zip))
+        return True
+
+    def is_uploaded(self, session: Optional[CloudShellAPISession] = None) -> bool:
+        """Returns whether the current zip content was already uploaded to the session (or shellfoundry config) server."""
+        ledger_key = f"{_server_id(session)}/{self.script_definition['metadata']['script_name']}"
+        return _read_ledger(self.dist).get(ledger_key) == file_hash(self.script_zip)
+
+
+def upload_script(
+    session: CloudShellAPISession,
+    script_name: str,
+    script_zip: Union[Path, bytes],
+    script_file_name: Optional[str] = None,
+    retries: int = UPLOAD_RETRIES,
+) -> Tuple[float, int]:
+    """Update existing script on server from memory or from (absolute) zip file path, without changing directory.
+
+    Transient (network) failures are retried with exponential backoff, so uploads can run concurrently from threads.
+
+    :param session: Session to upload with.
+    :param script_name: Name of the script to update.
+    :param script_zip: Zip content or zip file.
+    :param script_file_name: Zip file name reported to the server, default is the zip file name.
+    :param retries: Maximum number of retries on transient failures.
+    :return: Upload time, in seconds, and number of attempts.
+    """
+    content = script_zip if isinstance(script_zip, bytes) else Path(script_zip).read_bytes()
+    script_file_name = script_file_name or (f"{script_name}.zip" if isinstance(script_zip, bytes) else Path(script_zip).name)
+    # Same request as CloudShellAPISession.UpdateScript, that reads the zip from the current directory.
+    request = OrderedDict(
+        [
+            ("method_name", "UpdateScript"),
+            ("scriptName", script_name),
+            ("scriptFile", base64.b64encode(content).decode()),
+            ("scriptFileName", script_file_name),
+        ]
+    )
+    start = time.perf_counter()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            session.generateAPIRequest(OrderedDict(request))
+            return time.perf_counter() - start, attempt
+        except TRANSIENT_ERRORS:
+            if attempt > retries:
+                raise
+            time.sleep(min(UPLOAD_BACKOFF * 2 ** (attempt - 1), UPLOAD_MAX_BACKOFF))
+
+
+def script_names(script_definition: str) -> List[str]:
+    """Returns names of all scripts defined in the script definition yaml."""
+    definition = _load_script_definition(script_definition)
+    if "scripts" not in definition:
+        return [definition["metadata"]["script_name"]]
+    return [script["script_name"] for script in definition["scripts"]]
+
+
+def vendor_dependencies(requirements_txt: Path, wheelhouse: Path, cache_dir: Path) -> Path:
+    """Returns dependency layer - folder with requirements installed from wheelhouse, without accessing any index.
+
+    Layers are cached under cache_dir by a key of the requirements content, the wheelhouse listing (wheel names, sizes
+    and modification times), the python version and the platform, so a layer is installed only once per requirements
+    version and wheelhouse, and layers with binary wheels are never reused by another python or platform. The layer is
+    installed into a temporary folder and renamed, so concurrent builds never see a partial layer.
+    """
+    layer = cache_dir.joinpath(_layer_key(requirements_txt, wheelhouse))
+    if layer.exists():
+        return layer
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    staging = Path(mkdtemp(prefix=f"{layer.name}.", dir=cache_dir))
+    pip_cmd = [sys.executable, "-m", "pip", "install", "--no-index", "--find-links", wheelhouse.as_posix()]
+    pip_cmd += ["--target", staging.as_posix(), "--requirement", requirements_txt.as_posix()]
+    pip_cmd += ["--no-compile", "--disable-pip-version-check", "--quiet"]
+    try:
+        subprocess.run(pip_cmd, check=True)
+        staging.rename(layer)
+    except OSError:
+        # Another build created the same layer meanwhile.
+        if not layer.exists():
+            raise
+    finally:
+        rmtree(staging, ignore_errors=True)
+    return layer
+
+
+def _layer_key(requirements_txt: Path, wheelhouse: Path) -> str:
+    """Returns dependency layer key - hash of the requirements, the wheelhouse listing, python version and platform."""
+    wheels = sorted(wheel for wheel in wheelhouse.iterdir() if wheel.is_file()) if wheelhouse.is_dir() else []
+    listing = [(wheel.name, wheel.stat().st_size, wheel.stat().st_mtime_ns) for wheel in wheels]
+    key = [file_hash(requirements_txt), listing, list(sys.version_info[:2]), sysconfig.get_platform()]
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()[:16]
+
+
+def _load_script_definition(script_definition: str) -> dict:
+    script_definition_yaml = script_definition if script_definition.endswith(".yaml") else f"{script_definition}.yaml"
+    with open(Path(os.getcwd()).joinpath(script_definition_yaml), "r") as file:
+        return yaml.safe_load(file)
+
+
+def _select_script(definition: dict, script_name: Optional[str]) -> dict:
+    """Returns single script definition of the requested script, merged with the multiple scripts definition defaults."""
+    if "scripts" not in definition:
+        return definition
+    scripts = {script["script_name"]: script for script in definition["scripts"]}
+    if script_name is None and len(scripts) == 1:
+        script_name = list(scripts)[0]
+    if script_name not in scripts:
+        raise ValueError(f"Script {script_name} not found, select one of {list(scripts)}")
+    files = definition.get("files") or {}
+    script_files = scripts[script_name].get("files") or {}
+    return {
+        "metadata": {**(definition.get("metadata") or {}), "script_name": script_name},
+        "files": {**files, **script_files, "exclude": (files.get("exclude") or []) + (script_files.get("exclude") or [])},
+    }
+
+
+def _write_reproducible(script: ZipFile, file: Path, arcname: str) -> None:
+    """Stream file into the zip with fixed timestamp and permissions."""
+    info = ZipInfo(arcname, date_time=ZIP_DATE_TIME)
+    info.compress_type = ZIP_DEFLATED
+    info.create_system = 3
+    info.external_attr = 0o644 << 16
+    with open(file, "rb") as source, script.open(info, "w") as target:
+        copyfileobj(source, target, 1024 * 1024)
+
+
+def _server_id(session: Optional[CloudShellAPISession]) -> str:
+    """Returns host/domain of the session, or of the shellfoundry config server if there is no session (without login)."""
+    if session:
+        return f"{session.host}/{getattr(session, 'domain_name', session.domain)}"
+    from shellfoundry.utilities.config_reader import (  # pylint: disable=import-outside-toplevel
+        CloudShellConfigReader,
+        Configuration,
+    )
+
+    config = Configuration(CloudShellConfigReader()).read()
+    return f"{config.host}/{config.domain}"
+
+
+def _read_ledger(dist: Path) -> Dict[str, str]:
+    """Returns content hash of the last uploaded zip by server/domain/script name."""
+    ledger = dist.joinpath(UPLOAD_LEDGER)
+    if not ledger.exists():
+        return {}
+    with open(ledger, "r") as file:
+        return json.load(file)
+
 
-    def get_main(self) -> None:
-        """Get requested content for __main__ file."""
-        if self.script_definition.get("files") and self.script_definition["files"].get("main"):
-            new_main_file_name = self.script_definition["files"]["main"]
-            new_main_path = SRC_DIR.joinpath(new_main_file_name)
-            existing_main_path = SRC_DIR.joinpath("__main__.py")
-            copyfile(new_main_path, existing_main_path)
-
-    def should_zip(self, file: str) -> bool:
-        """Returns whether the file should be added to the shell zip file or not."""
-        return not (
-            self.script_definition.get("files")
-            and self.script_definition["files"].get("exclude")
-            and file in self.script_definition["files"]["exclude"]
-        )
-
-    def zip_files(self) -> None:
-        """Zip files for upload."""
-        with ZipFile(self.script_zip, "w") as script:
-            for _, _, files in os.walk(SRC_DIR):
-                for file in files:
-                    if self.should_zip(file):
-                        script.write(SRC_DIR.joinpath(file), file)
-
-    def update_script(self) -> None:
-        """Update script name in metadata to zip file name."""
-        session = create_session_from_config()
-        os.chdir(self.dist)
-        session.UpdateScript(self.script_definition["metadata"]["script_name"], self.script_zip.name)
-        os.chdir("..")
+def _update_ledger(dist: Path, key: str, zip_hash: Optional[str]) -> None:
+    """Update ledger entry, the ledger is replaced atomically so concurrent readers never see a partial ledger."""
+    with _ledger_lock:
+        ledger = _read_ledger(dist)
+        ledger[key] = zip_hash
+        staging = dist.joinpath(f"{UPLOAD_LEDGER}.{os.getpid()}.tmp")
+        with open(staging, "w") as file:
+            json.dump(ledger, file, indent=2, sort_keys=True)
+        os.replace(staging, dist.joinpath(UPLOAD_LEDGER))
@@ -0,0 +1,452 @@
+"""
+Shellfoundry traffic shell utilities.
+
+Shell packages are written in memory, the driver zip is nested directly into the shell zip and drivermetadata.xml and
+TOSCA.meta are patched on the fly, so pack never modifies the working tree.
+
+Shell sub commands that run shellfoundry executors (install) run inside a throwaway build root. The build root mirrors
+the shell folder with links (or copies, where links are not supported) and holds its own TOSCA.meta and
+drivermetadata.xml set for the requested shell definition.
+
+Each shell package is accompanied by a build manifest (dist/<template name>.manifest.json) with content hashes of all
+pack inputs, so pack can be skipped when nothing changed since the last build, and by a generate record
+(dist/<template name>.generate.json) with hashes of the generate inputs, so generate can be skipped or limited to the
+node types that changed since the last generate.
+
+CloudShell packaging API and shellfoundry are imported only when a server is accessed.
+"""
+# pylint: disable=import-outside-toplevel
+import ast
+import filecmp
+import hashlib
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from importlib import metadata
+from io import BytesIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Lock
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from xml.etree import ElementTree
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+import yaml
+
+from shellfoundry_traffic.profile_utils import span
+
+STAGED_ENTRIES = ["src", "TOSCA-Metadata"]
+STORED_SUFFIXES = [".7z", ".gif", ".gz", ".ico", ".jpeg", ".jpg", ".png", ".whl", ".zip"]
+GLOBAL_DOMAIN = "Global"
+SHELL_IS_OFFICIAL_FLAG = "IsOfficial"
+# Bump when pack_shell output changes for the same inputs, so existing build manifests are invalidated.
+PACK_FORMAT = "1"
+
+_staged_build_lock = Lock()
+
+
+@contextmanager
+def staged_build(shell_definition_yaml: str, main_class: str) -> Iterator[Path]:
+    """Yields build root, set as current directory, staged for the requested shell definition and main class.
+
+    The working tree dist folder is linked so shellfoundry executors find packages created by pack_shell. On successful
+    exit, artifacts created under the build root dist folder (if it could not be linked) are copied back.
+
+    The current directory is process global, so staged builds are serialized - concurrent threads wait for the running
+    staged build to exit. Other threads must not rely on the current directory while a staged build runs, concurrent
+    builds should use pack_shell (which never changes directory) or separate processes.
+
+    :param shell_definition_yaml: Shell definition yaml file name, relative to the current directory.
+    :param main_class: Driver main class to set in the staged drivermetadata.xml.
+    """
+    with _staged_build_lock:
+        working_dir = Path(os.getcwd())
+        with TemporaryDirectory(prefix="shellfoundry_traffic_") as temp_dir:
+            build_root = Path(temp_dir)
+            for entry in working_dir.iterdir():
+                if entry.name not in STAGED_ENTRIES and not entry.name.startswith("."):
+                    _link(entry, build_root.joinpath(entry.name))
+            _link_tree(working_dir.joinpath("src"), build_root.joinpath("src"))
+            set_tosca_meta(working_dir, build_root, shell_definition_yaml)
+            set_driver_metadata(working_dir, build_root, main_class)
+            os.chdir(build_root)
+            try:
+                yield build_root
+            finally:
+                os.chdir(working_dir)
+            _copy_back(build_root.joinpath("dist"), working_dir.joinpath("dist"))
+
+
+def build_manifest(shell_definition_yaml: str, main_class: str) -> Dict[str, str]:
+    """Returns content hashes of all pack inputs of the requested shell definition, relative to the current directory.
+
+    Inputs are the pack format version, the main class and every file pack_shell reads - the shell definition yaml,
+    TOSCA.meta, the shell icon, all files under src (driver), all files under deployments (deployment) and all other
+    artifact files.
+    """
+    working_dir = Path(os.getcwd())
+    with open(shell_definition_yaml, "r") as file:
+        shell_definition = yaml.safe_load(file)
+    manifest = {"pack_format": PACK_FORMAT, "main_class": main_class}
+    inputs = [Path(shell_definition_yaml), Path("TOSCA-Metadata", "TOSCA.meta")]
+    if "template_icon" in shell_definition["metadata"]:
+        inputs.append(Path(shell_definition["metadata"]["template_icon"]))
+    inputs.extend(_folder_files(working_dir, "src"))
+    for node_type in (shell_definition.get("node_types") or {}).values():
+        for artifact_name, artifact in node_type.get("artifacts", {}).items():
+            if artifact_name == "deployment":
+                inputs.extend(_folder_files(working_dir, "deployments"))
+            elif artifact_name != "driver":
+                inputs.append(Path(artifact["file"]))
+    for input_file in inputs:
+        if input_file.exists():
+            manifest[input_file.as_posix()] = file_hash(input_file)
+    return manifest
+
+
+def _folder_files(working_dir: Path, folder: str) -> List[Path]:
+    """Returns files that zip_folder packs from folder, relative to the working dir, empty list if there is no folder."""
+    files_paths = []
+    for root, dirs, files in os.walk(working_dir.joinpath(folder)):
+        dirs[:] = sorted(sub_folder for sub_folder in dirs if sub_folder != "__pycache__")
+        relative_root = Path(root).relative_to(working_dir)
+        files_paths.extend(relative_root.joinpath(file) for file in sorted(files) if not file.endswith(".pyc"))
+    return files_paths
+
+
+def is_up_to_date(shell_zip: Path, manifest: Dict[str, str]) -> bool:
+    """Returns whether the shell package exists and was built from inputs with the same content hashes."""
+    manifest_json = shell_zip.with_suffix(".manifest.json")
+    if not shell_zip.exists() or not manifest_json.exists():
+        return False
+    with open(manifest_json, "r") as file:
+        return json.load(file) == manifest
+
+
+def write_manifest(shell_zip: Path, manifest: Dict[str, str]) -> None:
+    """Write build manifest next to the shell package."""
+    with open(shell_zip.with_suffix(".manifest.json"), "w") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+
+
+def generate_manifest(shell_definition_yaml: str) -> Dict[str, Any]:
+    """Returns hashes of all generate inputs of the requested shell definition.
+
+    Inputs are the generator (shellfoundry) version, the imported standards, each node type and the rest of the shell
+    definition.
+
+    Imported standards that exist as local files (relative to the shell definition) are hashed by content. Standards
+    resolved on the server are identified by their import declaration, which includes the standard version, so a
+    standard updated on the server without a version change requires generate --force.
+    """
+    with open(shell_definition_yaml, "r") as file:
+        shell_definition = yaml.safe_load(file)
+    node_types = shell_definition.pop("node_types", None) or {}
+    imports = shell_definition.pop("imports", None) or []
+    return {
+        "generator": metadata.version("shellfoundry"),
+        "imports": _yaml_hash(_resolve_imports(imports, Path(shell_definition_yaml).parent)),
+        "definition": _yaml_hash(shell_definition),
+        "node_types": {name: _yaml_hash(node_type) for name, node_type in node_types.items()},
+    }
+
+
+def changed_node_types(previous: Dict[str, Any], current: Dict[str, Any]) -> Optional[List[str]]:
+    """Returns node types that were added or modified between two generate manifests.
+
+    :return: Added or modified node types, None if anything other than added or modified node types changed.
+    """
+    if any(previous.get(key) != current[key] for key in ["generator", "imports", "definition"]):
+        return None
+    if not previous["node_types"].keys() <= current["node_types"].keys():
+        return None
+    return [name for name, node_hash in current["node_types"].items() if previous["node_types"].get(name) != node_hash]
+
+
+def read_generate_record(shell_zip: Path) -> Dict[str, Any]:
+    """Returns generate record (manifest and data model hash) of the last generate, empty dict if there is none."""
+    generate_json = shell_zip.with_suffix(".generate.json")
+    if not generate_json.exists():
+        return {}
+    with open(generate_json, "r") as file:
+        return json.load(file)
+
+
+def write_generate_record(shell_zip: Path, manifest: Dict[str, Any], data_model_py: Path) -> None:
+    """Write generate record next to the shell package."""
+    with open(shell_zip.with_suffix(".generate.json"), "w") as file:
+        json.dump({"manifest": manifest, "data_model": file_hash(data_model_py)}, file, indent=2, sort_keys=True)
+
+
+def generate_data_model(shell_zip: Path, destination: Path) -> None:
+    """Generate driver data model of the shell package on CloudShell server (shellfoundry generate) into destination."""
+    from shellfoundry.utilities.config_reader import (
+        CloudShellConfigReader,
+        Configuration,
+    )
+    from shellfoundry.utilities.driver_generator import DriverGenerator
+
+    class _DriverGenerator(DriverGenerator):  # pylint: disable=too-few-public-methods
+        """DriverGenerator that also works with cloudshell-rest-api 8.x clients, that keep the token in client.token."""
+
+        @staticmethod
+        def _connect_to_cloudshell(cloudshell_config: Any) -> Any:
+            client = DriverGenerator._connect_to_cloudshell(cloudshell_config)  # pylint: disable=protected-access
+            if not hasattr(client, "_token"):
+                client._token = client.token  # pylint: disable=protected-access
+            return client
+
+    config = Configuration(CloudShellConfigReader()).read()
+    _DriverGenerator().generate_driver(config, destination.as_posix(), shell_zip.as_posix(), shell_zip.name, shell_zip.stem)
+    # DriverGenerator reports server errors without raising.
+    if not destination.joinpath("data_model.py").exists():
+        raise RuntimeError(f"Failed to generate data model for {shell_zip.name}")
+
+
+def merge_data_model(existing: str, generated: str) -> str:
+    """Merge partially generated data model into existing data model.
+
+    Classes of the generated data model replace classes with the same name in the existing data model, new classes
+    are appended. The module header (imports) is taken from the generated data model.
+    """
+    existing_header, existing_classes = _split_classes(existing)
+    generated_header, generated_classes = _split_classes(generated)
+    merged = {name: generated_classes.get(name, source) for name, source in existing_classes.items()}
+    merged.update({name: source for name, source in generated_classes.items() if name not in merged})
+    return (generated_header or existing_header) + "\n\n\n".join(source.rstrip("\n") for source in merged.values()) + "\n"
+
+
+def file_hash(file: Path) -> Optional[str]:
+    """Returns sha256 of the file content, None if the file does not exist."""
+    return hashlib.sha256(file.read_bytes()).hexdigest() if file.exists() else None
+
+
+def pack_shell(shell_definition_yaml: str, main_class: str, shell_zip: Path, node_types: Optional[List[str]] = None) -> None:
+    """Create TOSCA shell package for the requested shell definition and main class, relative to the current directory.
+
+    The package layout is the same as shellfoundry pack - TOSCA.meta, shell definition, icon and artifacts, with the
+    driver (and optional deployment) artifacts zipped from the driver (deployment) folder.
+
+    :param node_types: If set, pack only these node types of the shell definition (used for partial generate).
+    """
+    working_dir = Path(os.getcwd())
+    with span("load yaml"), open(shell_definition_yaml, "r") as file:
+        shell_definition = yaml.safe_load(file)
+    shell_zip.parent.mkdir(parents=True, exist_ok=True)
+    with ZipFile(shell_zip, "w", ZIP_DEFLATED) as package:
+        with span("tosca meta"):
+            package.writestr("TOSCA-Metadata/TOSCA.meta", tosca_meta(working_dir, shell_definition_yaml))
+        if node_types is None:
+            package.write(shell_definition_yaml, Path(shell_definition_yaml).name)
+        else:
+            shell_definition["node_types"] = {name: shell_definition["node_types"][name] for name in node_types}
+            package.writestr(Path(shell_definition_yaml).name, yaml.safe_dump(shell_definition, sort_keys=False))
+        if "template_icon" in shell_definition["metadata"]:
+            _write_artifact(package, Path(shell_definition["metadata"]["template_icon"]))
+        for node_type in shell_definition["node_types"].values():
+            for artifact_name, artifact in node_type.get("artifacts", {}).items():
+                artifact_file = Path(artifact["file"]).name
+                if artifact_name == "driver":
+                    with span("driver metadata"):
+                        driver_metadata_xml = driver_metadata(working_dir, main_class)
+                    with span("zip driver"):
+                        driver = zip_folder(working_dir.joinpath("src"), {"drivermetadata.xml": driver_metadata_xml})
+                    package.writestr(artifact_file, driver, compress_type=_compress_type(artifact_file))
+                elif artifact_name == "deployment" and working_dir.joinpath("deployments").exists():
+                    deployment = zip_folder(working_dir.joinpath("deployments"))
+                    package.writestr(artifact_file, deployment, compress_type=_compress_type(artifact_file))
+                else:
+                    _write_artifact(package, Path(artifact["file"]))
+
+
+def zip_folder(folder: Path, overrides: Optional[Dict[str, bytes]] = None) -> bytes:
+    """Returns zip, built in memory, of all files under folder, excluding compiled python files.
+
+    :param folder: Folder to zip, entries are relative to the folder.
+    :param overrides: Content to write instead of the file content, by entry name.
+    """
+    if not folder.exists():
+        raise FileNotFoundError(f"Invalid driver structure. Can't find '{folder.name}' folder.")
+    overrides = overrides or {}
+    buffer = BytesIO()
+    with ZipFile(buffer, "w", ZIP_DEFLATED) as folder_zip:
+        for root, dirs, files in os.walk(folder):
+            dirs[:] = sorted(sub_folder for sub_folder in dirs if sub_folder != "__pycache__")
+            relative_root = Path(root).relative_to(folder)
+            if relative_root != Path("."):
+                folder_zip.write(root, relative_root.as_posix())
+            for file in sorted(files):
+                if file.endswith(".pyc"):
+                    continue
+                arcname = relative_root.joinpath(file).as_posix()
+                if arcname in overrides:
+                    folder_zip.writestr(arcname, overrides[arcname], compress_type=_compress_type(arcname))
+                else:
+                    folder_zip.write(Path(root).joinpath(file), arcname, compress_type=_compress_type(arcname))
+    return buffer.getvalue()
+
+
+def tosca_meta(working_dir: Path, shell_definition_yaml: str) -> bytes:
+    """Returns TOSCA.meta content with Entry-Definitions set to the requested shell definition."""
+    with open(working_dir.joinpath("TOSCA-Metadata", "TOSCA.meta"), "r") as file:
+        meta_data = yaml.safe_load(file)
+    meta_data["Entry-Definitions"] = shell_definition_yaml
+    return yaml.dump(meta_data).encode()
+
+
+def driver_metadata(working_dir: Path, main_class: str) -> bytes:
+    """Returns drivermetadata.xml content with MainClass and Name set to the requested main class."""
+    drivermetadata = ElementTree.parse(working_dir.joinpath("src", "drivermetadata.xml"))
+    drivermetadata.getroot().attrib["MainClass"] = main_class
+    drivermetadata.getroot().attrib["Name"] = main_class.split(".")[1]
+    return ElementTree.tostring(drivermetadata.getroot())
+
+
+def create_packaging_client(server: Optional[Dict[str, Any]] = None) -> Any:
+    """Create packaging REST API client, logged in to the requested server.
+
+    As in shellfoundry install, shells can be installed only into the Global domain, so other domains are rejected before
+    login.
+
+    :param server: Server profile - host, port (default 9000), username, password and domain (default Global). If None,
+        log in with data in shellfoundry config.
+    """
+    from cloudshell.rest.api import PackagingRestApiClient
+    from shellfoundry.utilities.config_reader import (
+        CloudShellConfigReader,
+        Configuration,
+    )
+
+    if server:
+        host, port = server["host"], server.get("port", 9000)
+        username, password, domain = server["username"], server["password"], server.get("domain", GLOBAL_DOMAIN)
+    else:
+        config = Configuration(CloudShellConfigReader()).read()
+        host, port, username, password, domain = config.host, config.port, config.username, config.password, config.domain
+    if domain != GLOBAL_DOMAIN:
+        raise ValueError(f"Gen2 shells could not be installed into non {GLOBAL_DOMAIN} domain {domain}")
+    return PackagingRestApiClient(host, port, username, password, domain)
+
+
+def upload_shell(client: Any, shell_zip: Path, allow_official: bool = False) -> None:
+    """Update existing shell on server, add the shell if it does not exist.
+
+    As in shellfoundry install, the installed shell is checked first - a custom shell limits the server to custom
+    versions of the shell from then on, so official shells are not overwritten unless explicitly allowed.
+
+    :param client: Logged in packaging REST API client (see create_packaging_client).
+    :param shell_zip: Shell package, the package name is the shell name.
+    :param allow_official: If True, overwrite the shell even if the installed shell is an official shell.
+    """
+    from cloudshell.rest.exceptions import FeatureUnavailable, ShellNotFoundException
+
+    try:
+        is_official = client.get_shell(shell_zip.stem).get(SHELL_IS_OFFICIAL_FLAG, False)
+    except FeatureUnavailable:
+        is_official = False
+    except ShellNotFoundException:
+        client.add_shell(shell_zip.as_posix())
+        return
+    if is_official and not allow_official:
+        raise ValueError(f"{shell_zip.stem} is an official shell, overwriting it with a custom shell must be allowed")
+    try:
+        client.update_shell(shell_zip.as_posix())
+    except ShellNotFoundException:
+        client.add_shell(shell_zip.as_posix())
+
+
+def set_tosca_meta(working_dir: Path, build_root: Path, shell_definition_yaml: str) -> None:
+    """Write build root TOSCA.meta with Entry-Definitions set to the requested shell definition."""
+    staged_tosca_meta = build_root.joinpath("TOSCA-Metadata", "TOSCA.meta")
+    staged_tosca_meta.parent.mkdir(parents=True, exist_ok=True)
+    staged_tosca_meta.write_bytes(tosca_meta(working_dir, shell_definition_yaml))
+
+
+def set_driver_metadata(working_dir: Path, build_root: Path, main_class: str) -> None:
+    """Write build root drivermetadata.xml with MainClass and Name set to the requested main class."""
+    drivermetadata_xml = build_root.joinpath("src", "drivermetadata.xml")
+    # Remove the link first, otherwise the write goes through to the working tree file.
+    if drivermetadata_xml.is_symlink() or drivermetadata_xml.exists():
+        drivermetadata_xml.unlink()
+    drivermetadata_xml.write_bytes(driver_metadata(working_dir, main_class))
+
+
+def _resolve_imports(imports: List[Any], base_dir: Path) -> List[Dict[str, Optional[str]]]:
+    """Returns import declarations with the content hash of each imported file, None if the file is not local."""
+    resolved = []
+    for declaration in imports:
+        for name, import_file in declaration.items() if isinstance(declaration, dict) else [("", declaration)]:
+            local_file = base_dir.joinpath(str(import_file))
+            content = file_hash(local_file) if local_file.is_file() else None
+            resolved.append({"name": name, "file": str(import_file), "content": content})
+    return resolved
+
+
+def _yaml_hash(data: Any) -> str:
+    return hashlib.sha256(yaml.safe_dump(data, sort_keys=True).encode()).hexdigest()
+
+
+def _split_classes(source: str) -> Tuple[str, Dict[str, str]]:
+    """Split module source to header (everything before the first class) and top level classes sources, by name.
+
+    Top level statements between classes are kept with the preceding class.
+    """
+    lines = source.splitlines(keepends=True)
+    classes = [node for node in ast.parse(source).body if isinstance(node, ast.ClassDef)]
+    if not classes:
+        return source, {}
+    starts = [min([node.lineno] + [decorator.lineno for decorator in node.decorator_list]) - 1 for node in classes]
+    starts.append(len(lines))
+    class_sources = {node.name: "".join(lines[starts[index] : starts[index + 1]]) for index, node in enumerate(classes)}
+    return "".join(lines[: starts[0]]), class_sources
+
+
+def _compress_type(file_name: str) -> int:
+    """Store already compressed files, deflate all others."""
+    return ZIP_STORED if Path(file_name).suffix.lower() in STORED_SUFFIXES else ZIP_DEFLATED
+
+
+def _write_artifact(package: ZipFile, artifact: Path) -> None:
+    """Write artifact to the package root, artifacts referenced more than once (e.g. icon) are written once."""
+    if artifact.exists() and artifact.name not in package.namelist():
+        package.write(artifact, artifact.name, compress_type=_compress_type(artifact.name))
+
+
+def _link(source: Path, target: Path) -> None:
+    """Link target to source, fallback to copy on platforms/users that cannot create symbolic links."""
+    try:
+        os.symlink(source, target, target_is_directory=source.is_dir())
+    except OSError:
+        if source.is_dir():
+            shutil.copytree(source, target)
+        else:
+            shutil.copy2(source, target)
+
+
+def _link_tree(source: Path, target: Path) -> None:
+    """Mirror source folder structure under target and link each file.
+
+    Folders are created, not linked, because os.walk (used by shellfoundry to zip the driver) does not descend into
+    linked folders.
+    """
+    for root, _, files in os.walk(source):
+        target_root = target.joinpath(Path(root).relative_to(source))
+        target_root.mkdir(parents=True, exist_ok=True)
+        for file in files:
+            _link(Path(root).joinpath(file), target_root.joinpath(file))
+
+
+def _copy_back(source: Path, target: Path) -> None:
+    """Copy regular files that are new or modified under source to target."""
+    if not source.exists():
+        return
+    for root, _, files in os.walk(source):
+        for file in files:
+            staged_file = Path(root).joinpath(file)
+            if staged_file.is_symlink():
+                continue
+            target_file = target.joinpath(staged_file.relative_to(source))
+            if not target_file.exists() or not filecmp.cmp(staged_file, target_file, shallow=False):
+                target_file.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(staged_file, target_file)
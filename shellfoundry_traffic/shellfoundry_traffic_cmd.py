@@ -1,97 +1,639 @@
 #!/usr/bin/env python
 """
 shellfoundry_traffic CLI command.
+
+Sub commands import their heavy dependencies (shellfoundry executors, CloudShell API) only when they run, so the CLI
+startup, --help and --version stay cheap.
 """
+# pylint: disable=import-outside-toplevel
+import glob
 import os
-import subprocess
+import shutil
 import sys
-from argparse import ArgumentParser, Namespace, RawDescriptionHelpFormatter
+import time
+from argparse import (
+    SUPPRESS,
+    Action,
+    ArgumentParser,
+    Namespace,
+    RawDescriptionHelpFormatter,
+)
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from importlib import metadata
 from pathlib import Path
-from typing import Optional
-from xml.etree import ElementTree
+from tempfile import TemporaryDirectory
+from threading import Event
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
 
 import yaml
-from shellfoundry.commands.generate_command import GenerateCommandExecutor
-from shellfoundry.commands.install_command import InstallCommandExecutor
-from shellfoundry.commands.pack_command import PackCommandExecutor
-
-from shellfoundry_traffic.script_utils import ScriptCommandExecutor
 
-pip_show_cmd = "py -3 -m pip show shellfoundry_traffic".split()
-pip_output = subprocess.run(pip_show_cmd, stdout=subprocess.PIPE, check=False).stdout.decode()
-try:
-    VERSION = pip_output.strip().split("\n")[1].split()[1]
-except IndexError:
-    VERSION = r"N/A"
+from shellfoundry_traffic import profile_utils
+from shellfoundry_traffic.profile_utils import PROFILER, Span, record_stages, span
+from shellfoundry_traffic.shell_utils import (
+    build_manifest,
+    changed_node_types,
+    create_packaging_client,
+    file_hash,
+    generate_data_model,
+    generate_manifest,
+    is_up_to_date,
+    merge_data_model,
+    pack_shell,
+    read_generate_record,
+    staged_build,
+    upload_shell,
+    write_generate_record,
+    write_manifest,
+)
+from shellfoundry_traffic.watch_utils import ChangeWatcher
+
+
+@lru_cache(maxsize=None)
+def get_version() -> str:
+    """Returns shellfoundry-traffic version from installed package metadata, fallback to setuptools-scm version."""
+    try:
+        return metadata.version("shellfoundry-traffic")
+    except metadata.PackageNotFoundError:
+        pass
+    try:
+        from setuptools_scm import get_version as get_scm_version
+
+        return get_scm_version(root=Path(__file__).parent.parent.as_posix())
+    except (ImportError, LookupError):
+        return r"N/A"
+
+
+class VersionAction(Action):
+    """Print version and exit, version is resolved only when the option is actually requested."""
+
+    # pylint: disable=redefined-builtin
+    def __init__(self, option_strings: list, dest: str = SUPPRESS, default: str = SUPPRESS, help: str = None) -> None:
+        super().__init__(option_strings=option_strings, dest=dest, default=default, nargs=0, help=help)
+
+    def __call__(self, parser: ArgumentParser, namespace: Namespace, values: Any, option_string: str = None) -> None:
+        sys.stdout.write(f"{get_version()}\n")
+        parser.exit()
+
+
+DEFAULT_UPLOAD_JOBS = 4
 
 
 def _get_main_class(shell_definition_yaml: str) -> str:
-    with open(shell_definition_yaml, "r") as file:
+    with span("load yaml"), open(shell_definition_yaml, "r") as file:
         shell_definition = yaml.safe_load(file)
         return shell_definition["metadata"]["traffic"]["main_class"]
 
 
-def _set_toska_meta(shell_definition_yaml: str) -> None:
-    tosca_meta = Path(os.getcwd()).joinpath("TOSCA-Metadata").joinpath("TOSCA.meta")
-    with open(tosca_meta, "r") as file:
-        meta_data = yaml.safe_load(file)
-        meta_data["Entry-Definitions"] = shell_definition_yaml
-    with open(tosca_meta, "w") as file:
-        yaml.dump(meta_data, file)
+def _get_template_name(shell_definition_yaml: str) -> str:
+    with span("load yaml"), open(shell_definition_yaml, "r") as file:
+        shell_definition = yaml.safe_load(file)
+        return shell_definition["metadata"]["template_name"]
 
 
-def generate(shell_definition_yaml: str) -> None:
-    """Set Entry-Definitions in TOSCA.meta to the requested shell-definition yaml and call shellfoundry generate."""
-    _set_toska_meta(shell_definition_yaml)
-    pack(shell_definition_yaml)
-    GenerateCommandExecutor().generate()
+def _get_shell_zip(shell_definition_yaml: str) -> Path:
+    return Path(os.getcwd()).joinpath("dist", f"{_get_template_name(shell_definition_yaml)}.zip")
 
 
-def install(shell_definition_yaml: str) -> None:
-    """Set MainClass in driver metadata yaml to the requested class and call shellfoundry install."""
-    pack(shell_definition_yaml)
-    InstallCommandExecutor().install()
+def _shell_definition_yaml(shell_definition: str) -> str:
+    return shell_definition if shell_definition.endswith(".yaml") else f"{shell_definition}.yaml"
+
+
+def _definitions(patterns: List[str]) -> List[str]:
+    """Expand definition names and glob patterns to a list of unique yaml files, in order.
+
+    Raise ValueError if any glob pattern does not match any file.
+    """
+    definitions: List[str] = []
+    unmatched: List[str] = []
+    for pattern in patterns:
+        definition_yaml = _shell_definition_yaml(pattern)
+        matches = sorted(glob.glob(definition_yaml)) if glob.has_magic(definition_yaml) else [definition_yaml]
+        if not matches:
+            unmatched.append(definition_yaml)
+        definitions.extend(match for match in matches if match not in definitions)
+    if unmatched:
+        raise ValueError(f"No definition yaml files match {', '.join(unmatched)}")
+    return definitions
+
+
+class PackResult(NamedTuple):
+    """Summary of a single shell definition pack."""
+
+    shell_definition: str
+    seconds: float
+    size: int
+    cached: bool
+
+
+class InstallResult(NamedTuple):
+    """Summary of a single shell upload to a single server."""
+
+    shell_definition: str
+    server: str
+    seconds: float
+    size: int
+    error: str = ""
+
 
+class ScriptResult(NamedTuple):
+    """Summary of a single script zip and upload."""
 
-def pack(shell_definition: str) -> None:
-    """Set MainClass in driver metadata yaml to the requested class and call shellfoundry pack."""
-    shell_definition_yaml = shell_definition if shell_definition.endswith(".yaml") else f"{shell_definition}.yaml"
-    _set_toska_meta(shell_definition_yaml)
-    drivermetadata_xml = Path(os.getcwd()).joinpath("src").joinpath("drivermetadata.xml")
-    drivermetadata = ElementTree.parse(drivermetadata_xml)
+    script_definition: str
+    script_name: str
+    seconds: float
+    size: int
+    upload_seconds: float
+    status: str
+
+
+def generate(shell_definition: str, force: bool = False) -> List[str]:
+    """Generate driver data model (src/data_model.py) for the requested shell-definition yaml.
+
+    Generate is skipped if the shell definition, its imported standards and the generator version did not change since
+    the last generate (and the data model was not modified). If only node types were added or modified, only their
+    classes are regenerated and merged into the existing data model.
+
+    :param shell_definition: Shell definition yaml file.
+    :param force: If True, generate the full data model even if the generate record is up to date.
+    :return: Generated node types, empty list if generate was skipped.
+    """
+    shell_definition_yaml = _shell_definition_yaml(shell_definition)
+    pack(shell_definition_yaml)
+    shell_zip = _get_shell_zip(shell_definition_yaml)
+    src = Path(os.getcwd()).joinpath("src")
+    with span("generate manifest"):
+        manifest = generate_manifest(shell_definition_yaml)
+        record = read_generate_record(shell_zip)
+    node_types = list(manifest["node_types"])
+    if not force and record and record["data_model"] == file_hash(src.joinpath("data_model.py")):
+        changed = changed_node_types(record["manifest"], manifest)
+        if changed == []:
+            return []
+        node_types = changed or node_types
+    partial = node_types != list(manifest["node_types"])
+    with TemporaryDirectory(prefix="shellfoundry_traffic_") as temp_dir:
+        generated = Path(temp_dir).joinpath("generated")
+        if partial:
+            partial_zip = Path(temp_dir).joinpath(shell_zip.name)
+            with span("pack"):
+                pack_shell(shell_definition_yaml, _get_main_class(shell_definition_yaml), partial_zip, node_types)
+            with span("generate data model"):
+                generate_data_model(partial_zip, generated)
+        else:
+            with span("generate data model"):
+                generate_data_model(shell_zip, generated)
+        for generated_file in [file for file in generated.rglob("*") if file.is_file()]:
+            src_file = src.joinpath(generated_file.relative_to(generated))
+            if partial and src_file.name == "data_model.py" and src_file.exists():
+                with span("merge data model"):
+                    src_file.write_text(merge_data_model(src_file.read_text(), generated_file.read_text()))
+            else:
+                src_file.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(generated_file, src_file)
+    write_generate_record(shell_zip, manifest, src.joinpath("data_model.py"))
+    return node_types
+
+
+def install(shell_definition: str) -> None:
+    """Pack the requested shell-definition yaml and call shellfoundry install in a staged build root."""
+    from shellfoundry.commands.install_command import InstallCommandExecutor
+
+    shell_definition_yaml = _shell_definition_yaml(shell_definition)
+    pack(shell_definition_yaml)
     main_class = _get_main_class(shell_definition_yaml)
-    drivermetadata.getroot().attrib["MainClass"] = main_class
-    drivermetadata.getroot().attrib["Name"] = main_class.split(".")[1]
-    drivermetadata.write(drivermetadata_xml)
-    PackCommandExecutor().pack()
+    with span("stage build root"), staged_build(shell_definition_yaml, main_class), span("shellfoundry install"):
+        InstallCommandExecutor().install()
+
+
+def install_all(
+    shell_definitions: List[str],
+    servers: Optional[Dict[str, Dict[str, Any]]] = None,
+    jobs: Optional[int] = None,
+    pack_jobs: Optional[int] = None,
+    allow_official: bool = False,
+) -> List[InstallResult]:
+    """Pack shell definitions and upload them concurrently to all servers, over one logged in client per server.
+
+    :param shell_definitions: Shell definition yaml files.
+    :param servers: Server profiles (see create_packaging_client) by name, if None install on shellfoundry config server.
+    :param jobs: Maximum number of concurrent uploads.
+    :param pack_jobs: Maximum number of parallel pack processes, default is the number of CPUs.
+    :param allow_official: If True, overwrite installed official shells with the custom shells.
+    """
+    pack_all(shell_definitions, pack_jobs)
+    servers = servers or {"default": {}}
+    uploads = [(definition, server) for server in servers for definition in shell_definitions]
+    if not uploads:
+        return []
+    with ThreadPoolExecutor(max_workers=min(jobs or DEFAULT_UPLOAD_JOBS, len(uploads))) as executor:
+        clients = dict(zip(servers, executor.map(_login, servers.values())))
+        return list(executor.map(lambda upload: _timed_upload(clients[upload[1]], *upload, allow_official), uploads))
+
+
+def _login(server: Dict[str, Any]) -> Tuple[Any, str]:
+    """Returns logged in client, or error if login failed, so a failing server does not fail other servers."""
+    try:
+        with span("login"):
+            return create_packaging_client(server), ""
+    except Exception as error:  # pylint: disable=broad-except
+        return None, f"login failed - {error}"
+
+
+def _timed_upload(client: Tuple[Any, str], shell_definition: str, server: str, allow_official: bool) -> InstallResult:
+    shell_zip = _get_shell_zip(_shell_definition_yaml(shell_definition))
+    size = shell_zip.stat().st_size
+    if client[1]:
+        return InstallResult(shell_definition, server, 0, size, client[1])
+    start = time.perf_counter()
+    try:
+        with span("upload"):
+            upload_shell(client[0], shell_zip, allow_official)
+        error = ""
+    except Exception as upload_error:  # pylint: disable=broad-except
+        error = str(upload_error) or repr(upload_error)
+    return InstallResult(shell_definition, server, time.perf_counter() - start, size, error)
+
+
+def _print_install_results(install_results: List[InstallResult]) -> None:
+    width = max(len("shell definition"), *(len(result.shell_definition) for result in install_results))
+    server_width = max(len("server"), *(len(result.server) for result in install_results))
+    print(  # noqa: T001
+        f"{'shell definition':<{width}}  {'server':<{server_width}}  {'time [s]':>9}  {'size [KB]':>10}  {'MB/s':>7}  status"
+    )
+    for result in install_results:
+        throughput = result.size / result.seconds / 1024 / 1024 if result.seconds else 0
+        print(  # noqa: T001
+            f"{result.shell_definition:<{width}}  {result.server:<{server_width}}  {result.seconds:>9.2f}  "
+            f"{result.size / 1024:>10.1f}  {throughput:>7.2f}  {result.error or 'installed'}"
+        )
 
 
-def script(script_definition_yaml: str) -> None:
-    """Create script package (zip file) under dist and upload to to CloudShell server."""
-    script_utils = ScriptCommandExecutor(script_definition_yaml)
-    script_utils.get_main()
-    script_utils.zip_files()
-    script_utils.update_script()
+def pack(shell_definition: str, force: bool = False) -> bool:
+    """Create shell package, with Entry-Definitions and MainClass set to the requested shell definition, under dist.
+
+    TOSCA.meta and drivermetadata.xml are patched in memory, the working tree is not modified.
+
+    :param shell_definition: Shell definition yaml file.
+    :param force: If True, pack even if the shell package is up to date with its build manifest.
+    :return: False if the shell package is up to date and pack was skipped, else True.
+    """
+    shell_definition_yaml = _shell_definition_yaml(shell_definition)
+    main_class = _get_main_class(shell_definition_yaml)
+    shell_zip = _get_shell_zip(shell_definition_yaml)
+    with span("build manifest"):
+        manifest = build_manifest(shell_definition_yaml, main_class)
+        if not force and is_up_to_date(shell_zip, manifest):
+            return False
+    with span("pack"):
+        pack_shell(shell_definition_yaml, main_class, shell_zip)
+    write_manifest(shell_zip, manifest)
+    return True
+
+
+def pack_all(shell_definitions: List[str], jobs: Optional[int] = None, force: bool = False) -> List[PackResult]:
+    """Pack multiple shell definitions in parallel, each in its own process and staged build root.
+
+    :param shell_definitions: Shell definition yaml files.
+    :param jobs: Maximum number of parallel pack processes, default is the number of CPUs.
+    :param force: If True, pack even if shell packages are up to date with their build manifests.
+    """
+    if len(shell_definitions) <= 1:
+        return [_timed_pack(shell_definition, force) for shell_definition in shell_definitions]
+    max_workers = min(jobs or os.cpu_count() or 1, len(shell_definitions))
+    if not PROFILER.enabled:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(_timed_pack, shell_definitions, [force] * len(shell_definitions)))
+    initargs = (PROFILER.profile_dir.as_posix() if PROFILER.profile_dir else None,)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=profile_utils.enable, initargs=initargs) as executor:
+        profiled_results = list(executor.map(_profiled_pack, shell_definitions, [force] * len(shell_definitions)))
+    for _, spans in profiled_results:
+        PROFILER.add(spans)
+    return [pack_result for pack_result, _ in profiled_results]
+
+
+def _profiled_pack(shell_definition: str, force: bool = False) -> Tuple[PackResult, List[Span]]:
+    """Pack in worker process and return the spans recorded by the worker along with the pack result."""
+    return _timed_pack(shell_definition, force), PROFILER.collect()
+
+
+def _timed_pack(shell_definition: str, force: bool = False) -> PackResult:
+    start = time.perf_counter()
+    packed = pack(shell_definition, force)
+    seconds = time.perf_counter() - start
+    shell_zip = _get_shell_zip(_shell_definition_yaml(shell_definition))
+    return PackResult(shell_definition, seconds, shell_zip.stat().st_size, not packed)
+
+
+def _print_pack_results(pack_results: List[PackResult]) -> None:
+    width = max(len("shell definition"), *(len(result.shell_definition) for result in pack_results))
+    print(f"{'shell definition':<{width}}  {'time [s]':>9}  {'size [KB]':>10}  status")  # noqa: T001
+    for result in pack_results:
+        status = "up to date" if result.cached else "packed"
+        print(  # noqa: T001
+            f"{result.shell_definition:<{width}}  {result.seconds:>9.2f}  {result.size / 1024:>10.1f}  {status}"
+        )
+
+
+def script(script_definition_yaml: str, session: Any = None, force: bool = False, wheelhouse: Optional[str] = None) -> bool:
+    """Create script package (zip file) under dist and upload to to CloudShell server.
+
+    :param script_definition_yaml: Script definition yaml file.
+    :param session: CloudShellAPISession to upload with, if None create new session from shellfoundry config.
+    :param force: If True, upload even if the same script package was already uploaded to the server.
+    :param wheelhouse: Folder with wheels to vendor src/requirements.txt dependencies from into the script package.
+    :return: False if the script package did not change since the last upload and upload was skipped, else True.
+    """
+    from shellfoundry_traffic.script_utils import ScriptCommandExecutor
+
+    with span("load yaml"):
+        script_utils = ScriptCommandExecutor(script_definition_yaml)
+    with span("zip script"):
+        script_utils.zip_files(wheelhouse)
+    with span("upload script"):
+        return script_utils.update_script(session, force)
+
+
+def script_all(
+    script_definitions: List[str],
+    jobs: Optional[int] = None,
+    force: bool = False,
+    wheelhouse: Optional[str] = None,
+    session: Any = None,
+    src_dir: Optional[str] = None,
+) -> List[ScriptResult]:
+    """Zip all scripts of the script definitions in parallel processes, then upload them concurrently over one session.
+
+    The session is created only if any script needs upload.
+
+    :param script_definitions: Script definition yaml files, each with a single script or multiple scripts.
+    :param jobs: Maximum number of parallel zip processes (default is the number of CPUs) and concurrent uploads.
+    :param force: If True, upload even if the same script package was already uploaded to the server.
+    :param wheelhouse: Folder with wheels to vendor src/requirements.txt dependencies from into the script packages.
+    :param session: CloudShellAPISession to upload with, if None create new session from shellfoundry config.
+    :param src_dir: Script sources folder, default is src under the current directory. Passed explicitly to the zip
+        processes, so they do not depend on their own current directory.
+    """
+    from shellfoundry_traffic.script_utils import ScriptCommandExecutor, script_names
+
+    scripts = [(definition, name) for definition in script_definitions for name in script_names(definition)]
+    if not scripts:
+        return []
+    src_dir = Path(src_dir or Path(os.getcwd()).joinpath("src")).resolve().as_posix()
+    executors = [ScriptCommandExecutor(definition, name, src_dir) for definition, name in scripts]
+    zips = _zip_scripts(scripts, jobs, wheelhouse, src_dir)
+    if any(force or not executor.is_uploaded(session) for executor in executors):
+        from shellfoundry_traffic.test_helpers import create_session_from_config
+
+        with span("login"):
+            session = session or create_session_from_config()
+    with ThreadPoolExecutor(max_workers=min(jobs or DEFAULT_UPLOAD_JOBS, len(executors))) as upload_executor:
+        uploads = upload_executor.map(lambda executor: _timed_script_upload(executor, session, force), executors)
+        return [
+            ScriptResult(definition, name, *script_zip, *upload)
+            for (definition, name), script_zip, upload in zip(scripts, zips, uploads)
+        ]
+
+
+def _timed_script_upload(executor: Any, session: Any, force: bool) -> Tuple[float, str]:
+    """Upload single script and returns upload time and status, upload errors do not fail other scripts."""
+    start = time.perf_counter()
+    try:
+        with span("upload script"):
+            status = "uploaded" if executor.update_script(session, force) else "up to date"
+    except Exception as error:  # pylint: disable=broad-except
+        status = f"failed - {error}"
+    return time.perf_counter() - start, status
+
+
+def _zip_scripts(
+    scripts: List[Tuple[str, str]], jobs: Optional[int], wheelhouse: Optional[str], src_dir: Optional[str] = None
+) -> List[Tuple[float, int]]:
+    """Zip scripts in parallel processes and returns zip time and size per script."""
+    if len(scripts) <= 1:
+        return [_timed_script_zip(definition, name, wheelhouse, src_dir) for definition, name in scripts]
+    with ProcessPoolExecutor(max_workers=min(jobs or os.cpu_count() or 1, len(scripts))) as executor:
+        definitions, names = zip(*scripts)
+        count = len(scripts)
+        return list(executor.map(_timed_script_zip, definitions, names, [wheelhouse] * count, [src_dir] * count))
+
+
+def _timed_script_zip(
+    script_definition: str, script_name: str, wheelhouse: Optional[str] = None, src_dir: Optional[str] = None
+) -> Tuple[float, int]:
+    """Zip single script and returns zip time and size."""
+    from shellfoundry_traffic.script_utils import ScriptCommandExecutor
+
+    start = time.perf_counter()
+    with span("load yaml"):
+        script_utils = ScriptCommandExecutor(script_definition, script_name, src_dir)
+    with span("zip script"):
+        script_utils.zip_files(wheelhouse)
+    return time.perf_counter() - start, script_utils.script_zip.stat().st_size
+
+
+def _print_script_results(script_results: List[ScriptResult]) -> None:
+    width = max([len("script")] + [len(result.script_name) for result in script_results])
+    print(f"{'script':<{width}}  {'zip [s]':>8}  {'size [KB]':>10}  {'upload [s]':>10}  status")  # noqa: T001
+    for result in script_results:
+        print(  # noqa: T001
+            f"{result.script_name:<{width}}  {result.seconds:>8.2f}  {result.size / 1024:>10.1f}  "
+            f"{result.upload_seconds:>10.2f}  {result.status}"
+        )
+
+
+def analyze_pack(shell_definition: str) -> List[Dict[str, Any]]:
+    """Pack the shell definition (even if up to date) and returns analysis report of the shell package."""
+    from shellfoundry_traffic.analyze_utils import analyze_package
+
+    shell_definition_yaml = _shell_definition_yaml(shell_definition)
+    with record_stages() as stages:
+        pack(shell_definition_yaml, force=True)
+    return [analyze_package(_get_shell_zip(shell_definition_yaml), stages)]
+
+
+def analyze_script(script_definition: str, wheelhouse: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Zip all scripts of the script definition, without upload, and returns analysis report per script package.
+
+    Droppable files are reported by the script exclude rules, or by common exclude rules if the script has none.
+    """
+    from shellfoundry_traffic.analyze_utils import analyze_package
+    from shellfoundry_traffic.script_utils import ScriptCommandExecutor, script_names
+
+    reports = []
+    for script_name in script_names(script_definition):
+        with record_stages() as stages:
+            _timed_script_zip(script_definition, script_name, wheelhouse)
+        script_utils = ScriptCommandExecutor(script_definition, script_name)
+        excludes = (script_utils.script_definition.get("files") or {}).get("exclude")
+        reports.append(analyze_package(script_utils.script_zip, stages, excludes))
+    return reports
+
+
+def _analyze(definitions: List[str], analyze: Any, max_size: Optional[float]) -> None:
+    """Analyze packages of all definitions, print reports and exit with error if any package exceeds max size (KB)."""
+    from shellfoundry_traffic.analyze_utils import print_report
+
+    oversized = []
+    for definition in definitions:
+        for report in analyze(definition):
+            print_report(report)
+            if max_size is not None and report["file_size"] > max_size * 1024:
+                oversized.append(report["package"])
+    if oversized:
+        print(f"packages exceed {max_size} KB: {', '.join(oversized)}")  # noqa: T001
+        sys.exit(1)
+
+
+def watch(  # pylint: disable=too-many-arguments
+    definitions: List[str],
+    action: str = "pack",
+    debounce: float = 0.5,
+    polling: bool = False,
+    stop: Optional[Event] = None,
+    *,
+    allow_official: bool = False,
+) -> None:
+    """Watch sources and definitions and rebuild (and reinstall/upload) on changes, until stopped.
+
+    Changes in a definition yaml rebuild that definition only, changes in shared sources (src, TOSCA-Metadata, icon)
+    rebuild all definitions. The server session is created once and reused between rebuilds.
+
+    :param definitions: Shell definition yaml files (action pack/install) or script definition yaml files (script).
+    :param action: pack, install (pack and install shell) or script (zip and upload script).
+    :param debounce: Changes are collected until there are no new changes for debounce seconds.
+    :param polling: If True, poll for changes even if watchdog is available.
+    :param stop: Event to stop watching, if None watch until interrupted.
+    :param allow_official: If True, action install overwrites installed official shells with the custom shells.
+    """
+    definitions = [_shell_definition_yaml(definition) for definition in definitions]
+    watched = [Path(definition) for definition in definitions] + [Path("src"), Path("TOSCA-Metadata")]
+    if action != "script":
+        with open(definitions[0], "r") as file:
+            icon = yaml.safe_load(file)["metadata"].get("template_icon")
+        watched.extend([Path(icon)] if icon else [])
+    watcher = ChangeWatcher([path for path in watched if path.exists()], debounce=debounce, polling=polling)
+    stop = stop or Event()
+    server = None
+    try:
+        server = _rebuild(definitions, action, server, initial=True, allow_official=allow_official)
+        while not stop.is_set():
+            changed = watcher.wait(timeout=0.5)
+            if changed:
+                server = _rebuild(_affected_definitions(definitions, changed), action, server, allow_official=allow_official)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.stop()
+
+
+def _affected_definitions(definitions: List[str], changed: Set[Path]) -> List[str]:
+    """Returns definitions whose yaml changed, or all definitions if any shared source changed."""
+    definition_paths = {Path(definition).resolve(): definition for definition in definitions}
+    if changed - definition_paths.keys():
+        return definitions
+    return [definition_paths[path] for path in changed]
+
+
+def _rebuild(definitions: List[str], action: str, server: Any, initial: bool = False, allow_official: bool = False) -> Any:
+    """Rebuild definitions and return the server session (created on first upload) to reuse in the next rebuild.
+
+    On initial rebuild, shells are installed even if the package is up to date. Shells are installed with the same
+    domain and official shell checks as install.
+    """
+    for definition in definitions:
+        start = time.perf_counter()
+        try:
+            if action == "script":
+                if not server:
+                    from shellfoundry_traffic.test_helpers import (
+                        create_session_from_config,
+                    )
+
+                    with span("login"):
+                        server = create_session_from_config()
+                status = "uploaded" if script(definition, server) else "up to date"
+            else:
+                packed = pack(definition)
+                if action == "install" and (packed or initial):
+                    with span("login"):
+                        server = server or create_packaging_client()
+                    with span("upload"):
+                        upload_shell(server, _get_shell_zip(definition), allow_official)
+                    status = "installed"
+                else:
+                    status = "packed" if packed else "up to date"
+        except Exception as error:  # pylint: disable=broad-except
+            # Keep watching, the error is probably fixed by the next change. Next upload will log in again.
+            server = None
+            status = f"failed - {error}"
+        print(f"{definition}: {status} ({time.perf_counter() - start:.2f}s)")  # noqa: T001
+    return server
 
 
 def generate_cli(parsed_args: Namespace) -> None:
     """Extract CLI attributes and call shellfoundry-traffic generate."""
-    generate(parsed_args.yaml)
+    for shell_definition in _definitions(parsed_args.yaml):
+        node_types = generate(shell_definition, parsed_args.force)
+        print(f"{shell_definition}: {', '.join(node_types) if node_types else 'up to date'}")  # noqa: T001
 
 
 def install_cli(parsed_args: Namespace) -> None:
     """Extract CLI attributes and call shellfoundry-traffic install."""
-    install(parsed_args.yaml)
+    shell_definitions = _definitions(parsed_args.yaml)
+    if len(shell_definitions) == 1 and not parsed_args.servers:
+        install(shell_definitions[0])
+        return
+    servers = _read_servers(parsed_args.servers) if parsed_args.servers else None
+    install_results = install_all(
+        shell_definitions, servers, parsed_args.jobs, parsed_args.pack_jobs, parsed_args.allow_official
+    )
+    _print_install_results(install_results)
+    if [result for result in install_results if result.error]:
+        sys.exit(1)
+
+
+def _read_servers(servers_yaml: str) -> Dict[str, Dict[str, Any]]:
+    """Returns server profiles by name from servers yaml file, raise ValueError if the file has no servers."""
+    with open(servers_yaml, "r") as file:
+        servers = (yaml.safe_load(file) or {}).get("servers")
+    if not servers:
+        raise ValueError(f"No servers in {servers_yaml}, expected servers: {{name: {{host, port, username, password}}}}")
+    return servers
 
 
 def pack_cli(parsed_args: Namespace) -> None:
     """Extract CLI attributes and call shellfoundry-traffic pack."""
-    pack(parsed_args.yaml)
+    if parsed_args.analyze:
+        _analyze(_definitions(parsed_args.yaml), analyze_pack, parsed_args.max_size)
+    else:
+        _print_pack_results(pack_all(_definitions(parsed_args.yaml), parsed_args.jobs, parsed_args.force))
 
 
 def script_cli(parsed_args: Namespace) -> None:
     """Extract CLI attributes and call shellfoundry-traffic update."""
-    script(parsed_args.yaml)
+    if parsed_args.analyze:
+        _analyze(
+            _definitions(parsed_args.yaml),
+            lambda definition: analyze_script(definition, parsed_args.wheelhouse),
+            parsed_args.max_size,
+        )
+        return
+    script_results = script_all(_definitions(parsed_args.yaml), parsed_args.jobs, parsed_args.force, parsed_args.wheelhouse)
+    _print_script_results(script_results)
+    if [result for result in script_results if result.status.startswith("failed")]:
+        sys.exit(1)
+
+
+def watch_cli(parsed_args: Namespace) -> None:
+    """Extract CLI attributes and call shellfoundry-traffic watch."""
+    watch(
+        _definitions(parsed_args.yaml),
+        parsed_args.action,
+        parsed_args.debounce,
+        parsed_args.polling,
+        allow_official=parsed_args.allow_official,
+    )
 
 
 def main(args: Optional[list] = None) -> None:
@@ -100,14 +642,32 @@ def main(args: Optional[list] = None) -> None:
         description="shellfoundry wrapper for traffic shells",
         formatter_class=RawDescriptionHelpFormatter,
     )
-    parser.add_argument("-V", "--version", action="version", version=VERSION)
+    parser.add_argument("-V", "--version", action=VersionAction, help="show program's version number and exit")
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="time sub command phases (yaml load, manifest, zip, login, upload...) and print a table",
+    )
+    parser.add_argument(
+        "--profile-trace",
+        metavar="JSON file",
+        type=str,
+        help="with --profile, also write phases timings as Chrome trace (chrome://tracing, https://ui.perfetto.dev)",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        metavar="folder",
+        type=str,
+        help="with --profile, also dump cProfile stats of each outermost phase under folder (python -m pstats)",
+    )
     parser.add_argument(
         "-y",
         "--yaml",
         required=True,
+        action="append",
         metavar="YAML file",
         type=str,
-        help="local shell definition yaml file",
+        help="local shell definition yaml file, repeat the option or use glob pattern for multiple definitions",
     )
 
     subparsers = parser.add_subparsers(help='type "shellfoundry-traffic [subcommand] -h" for help.')
@@ -115,33 +675,174 @@ def main(args: Optional[list] = None) -> None:
     parser_install = subparsers.add_parser(
         "install",
         formatter_class=RawDescriptionHelpFormatter,
-        description="set shell-definition.yaml and main class, then install",
+        description="pack, then install from staged build root\n"
+        "multiple shell definitions and/or servers are installed concurrently, one login per server",
+    )
+    parser_install.add_argument(
+        "-s",
+        "--servers",
+        metavar="YAML file",
+        type=str,
+        help="yaml file with server profiles (servers: {name: {host, port, username, password, domain}}), "
+        "default is the server in shellfoundry config",
+    )
+    parser_install.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help=f"maximum number of concurrent uploads, default is {DEFAULT_UPLOAD_JOBS}",
+    )
+    parser_install.add_argument(
+        "--pack-jobs",
+        type=int,
+        default=None,
+        help="maximum number of parallel pack processes, default is the number of CPUs",
+    )
+    parser_install.add_argument(
+        "--allow-official",
+        action="store_true",
+        help="overwrite installed official shells with the custom shells, the server will then accept only custom "
+        "versions of these shells",
     )
     parser_install.set_defaults(func=install_cli)
 
     parser_generate = subparsers.add_parser(
         "generate",
         formatter_class=RawDescriptionHelpFormatter,
-        description="set shell-definition.yaml file then generate",
+        description="pack, then generate data model\n"
+        "skipped if the shell definition did not change, only changed node types are regenerated",
+    )
+    parser_generate.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="generate full data model even if the shell definition did not change "
+        "(required after a standard was updated on the server without a version change)",
     )
     parser_generate.set_defaults(func=generate_cli)
 
     parser_pack = subparsers.add_parser(
         "pack",
         formatter_class=RawDescriptionHelpFormatter,
-        description="set shell-definition.yaml file and main class, then pack",
+        description="set shell-definition.yaml file and main class, then pack\n"
+        "multiple shell definitions are packed in parallel",
+    )
+    parser_pack.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="maximum number of parallel pack processes, default is the number of CPUs",
+    )
+    parser_pack.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="pack even if the shell package is up to date with its build manifest",
+    )
+    parser_pack.add_argument(
+        "-a",
+        "--analyze",
+        action="store_true",
+        help="pack (even if up to date) and report entries sizes, duplicated content, droppable files and build stages, "
+        "the report is also written to dist/<package name>.analysis.json",
+    )
+    parser_pack.add_argument(
+        "-m",
+        "--max-size",
+        metavar="KB",
+        type=float,
+        help="with --analyze, exit with error if any package is larger than KB",
     )
     parser_pack.set_defaults(func=pack_cli)
 
     parser_pack = subparsers.add_parser(
         "script",
         formatter_class=RawDescriptionHelpFormatter,
-        description="update existing script on server",
+        description="update existing script on server\n"
+        "skipped if the same script package was already uploaded to the server\n"
+        "multiple scripts are zipped in parallel and uploaded over one session",
+    )
+    parser_pack.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="maximum number of parallel zip processes (default is the number of CPUs) and concurrent uploads "
+        f"(default is {DEFAULT_UPLOAD_JOBS})",
+    )
+    parser_pack.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="upload even if the same script package was already uploaded to the server",
+    )
+    parser_pack.add_argument(
+        "-w",
+        "--wheelhouse",
+        metavar="folder",
+        type=str,
+        help="vendor src/requirements.txt dependencies from wheels in folder into the script package "
+        "(default is files.wheelhouse in the script definition)",
+    )
+    parser_pack.add_argument(
+        "-a",
+        "--analyze",
+        action="store_true",
+        help="zip, without upload, and report entries sizes, duplicated content, droppable files and build stages, "
+        "the report is also written to dist/<package name>.analysis.json",
+    )
+    parser_pack.add_argument(
+        "-m",
+        "--max-size",
+        metavar="KB",
+        type=float,
+        help="with --analyze, exit with error if any package is larger than KB",
     )
     parser_pack.set_defaults(func=script_cli)
 
+    parser_watch = subparsers.add_parser(
+        "watch",
+        formatter_class=RawDescriptionHelpFormatter,
+        description="watch src, TOSCA-Metadata and definitions and rebuild on changes, until interrupted (Ctrl+C)\n"
+        "uses watchdog if installed (pip install shellfoundry-traffic[watch]), else polls for changes",
+    )
+    parser_watch.add_argument(
+        "-a",
+        "--action",
+        choices=["pack", "install", "script"],
+        default="pack",
+        help="pack shell, pack and install shell or zip and upload script on changes",
+    )
+    parser_watch.add_argument(
+        "-d",
+        "--debounce",
+        type=float,
+        default=0.5,
+        help="rebuild after no new changes for debounce seconds",
+    )
+    parser_watch.add_argument("-p", "--polling", action="store_true", help="poll for changes even if watchdog is installed")
+    parser_watch.add_argument(
+        "--allow-official",
+        action="store_true",
+        help="with --action install, overwrite installed official shells with the custom shells",
+    )
+    parser_watch.set_defaults(func=watch_cli)
+
     parsed_args = parser.parse_args(args)
-    parsed_args.func(parsed_args)
+    if not parsed_args.profile:
+        parsed_args.func(parsed_args)
+        return
+    profile_utils.enable(parsed_args.profile_dir)
+    try:
+        with span(f"shellfoundry-traffic {parsed_args.func.__name__[: -len('_cli')]}", profile=False):
+            parsed_args.func(parsed_args)
+    finally:
+        PROFILER.print_table()
+        if parsed_args.profile_trace:
+            PROFILER.write_trace(parsed_args.profile_trace)
+        PROFILER.disable()
 
 
 if __name__ == "__main__":
@@ -1,21 +1,45 @@
 """
 Test helpers for shells and scripts testing.
+
+CloudShell sessions are cached per process by host, user and domain, so tests, fixtures and CLI commands share a single
+login. Cached sessions log in again, transparently, when their token expires.
 """
 # pylint: disable=redefined-outer-name
+import asyncio
 import os
 import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from fnmatch import fnmatch
+from functools import lru_cache, partial
 from pathlib import Path
-from typing import Iterable, List, Optional, Tuple
+from threading import Lock
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
 
 import pytest
 import yaml
 from cloudshell.api.cloudshell_api import (
     CloudShellAPISession,
     CreateReservationResponseInfo,
+    FindResourceInfo,
+    ReservationShortInfo,
     ResourceAttributesUpdateRequest,
     ResourceInfo,
     UpdateTopologyGlobalInputsRequest,
 )
+from cloudshell.api.common_cloudshell_api import CloudShellAPIError
 from cloudshell.helpers.scripts.cloudshell_dev_helpers import attach_to_cloudshell_as
 from cloudshell.shell.core.driver_context import (
     AppContext,
@@ -27,10 +51,40 @@ from cloudshell.shell.core.driver_context import (
     ResourceContextDetails,
 )
 from cloudshell.shell.core.session.cloudshell_session import CloudShellSessionContext
+from shellfoundry.utilities.config.config_providers import DefaultConfigProvider
 from shellfoundry.utilities.config_reader import CloudShellConfigReader, Configuration
 
 import shellfoundry_traffic.cloudshell_scripts_helpers as script_helpers
 
+# Error codes of requests rejected, before they run, because the session token is invalid or expired. Only these are
+# resent after login, other errors (even if the message mentions a token) may come from requests that already ran.
+INVALID_TOKEN_ERROR_CODES = ["105"]
+LOGON_METHODS = ["Logon", "SecureLogon"]
+
+# Reservation teardown polling - first interval, backoff factor, ceiling interval and overall deadline, in seconds.
+POLL_INTERVAL = 0.1
+POLL_BACKOFF = 1.5
+POLL_MAX_INTERVAL = 5.0
+END_RESERVATION_TIMEOUT = 600.0
+DEFAULT_TEARDOWN_JOBS = 8
+# CloudShellAPISession default datetimeformat (MM/dd/yyyy HH:mm) and timezone (UTC).
+RESERVATION_TIME_FORMAT = "%m/%d/%Y %H:%M"
+# AsyncTgTestHelpers - shared executor size and default timeout, in seconds, of a single helper call.
+DEFAULT_ASYNC_JOBS = 8
+ASYNC_CALL_TIMEOUT = 600.0
+# Default reservations are named "<prefix> <xdist worker>" and ReservationPool reservations "<prefix> <xdist worker> <n>",
+# so pytest-xdist workers never end each other's reservations.
+POOL_RESERVATION_PREFIX = "tg regression tests"
+# Number of empty reservations the reservation_pool fixture creates upfront, overridden by environment variable.
+RESERVATION_POOL_WARM_ENV = "TG_RESERVATION_POOL_WARM"
+DEFAULT_PROVISION_JOBS = 8
+
+_sessions: Dict[Tuple[str, int, str, str], "CachedSession"] = {}
+_sessions_lock = Lock()
+_session_locks: Dict[Tuple[str, int, str, str], Lock] = {}
+_executor: Optional[ThreadPoolExecutor] = None  # pylint: disable=invalid-name
+_executor_lock = Lock()
+
 
 def load_devices(devices_env: str) -> dict:
     """Load devices from devices file."""
@@ -50,15 +104,93 @@ def print_inventory(inventory: AutoLoadDetails) -> None:
         print(f"{attribute.relative_address}, {attribute.attribute_name}, {attribute.attribute_value}")
 
 
-def create_session_from_config() -> CloudShellAPISession:
-    """Create session from data in shellfoundry config."""
-    config = Configuration(CloudShellConfigReader()).read()
-    session = CloudShellAPISession(config.host, config.username, config.password, config.domain)
-    # session.domain is Domain ID so we save the domain name in session.domain_name
-    session.domain_name = config.domain
+class CachedSession(CloudShellAPISession):
+    """CloudShell API session, shared between threads, that logs in again when its token expires."""
+
+    def __init__(self, host: str, username: str, password: str, domain: str = "Global", port: int = 8029) -> None:
+        self._login_lock = Lock()
+        super().__init__(host, username, password, domain, port=port)
+        # session.domain is Domain ID so we save the domain name in session.domain_name
+        self.domain_name = domain
+
+    def generateAPIRequest(self, kwargs: Dict[str, Any]) -> Any:  # pylint: disable=invalid-name
+        """Send API request, on expired token log in again and resend the request once."""
+        request = OrderedDict(kwargs)
+        token_id = self.token_id
+        try:
+            return super().generateAPIRequest(kwargs)
+        except CloudShellAPIError as error:
+            if request["method_name"] in LOGON_METHODS or str(error.code) not in INVALID_TOKEN_ERROR_CODES:
+                raise
+        self.relogin(token_id)
+        return super().generateAPIRequest(request)
+
+    def relogin(self, expired_token_id: Optional[str] = None) -> None:
+        """Log in again, unless another thread already replaced the expired token.
+
+        :param expired_token_id: Token that was rejected, if None log in again anyway.
+        """
+        with self._login_lock:
+            if expired_token_id is not None and self.token_id != expired_token_id:
+                return
+            response_info = self.Logon(self.username, self.password, self.domain_name)
+            self.domain = response_info.Domain.DomainId
+            self.token_id = response_info.Token.Token
+
+
+def get_session(host: str, username: str, password: str, domain: str = "Global", port: int = 8029) -> CachedSession:
+    """Returns session, cached per process by host, port, user and domain (thread safe).
+
+    The session logs in when it is created. Creation is locked per key, so concurrent calls for the same key log in once
+    and calls for other keys (other servers) do not wait for the login.
+    """
+    key = (host, port, username, domain)
+    with _sessions_lock:
+        key_lock = _session_locks.setdefault(key, Lock())
+    with key_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = CachedSession(host, username, password, domain, port)
+            with _sessions_lock:
+                _sessions[key] = session
     return session
 
 
+def clear_sessions() -> None:
+    """Forget all cached sessions (and shellfoundry config), next requests log in again."""
+    with _sessions_lock:
+        _sessions.clear()
+        _session_locks.clear()
+    _read_config.cache_clear()
+
+
+def create_session_from_config() -> CloudShellAPISession:
+    """Returns cached session to the server in shellfoundry config.
+
+    The config is cached by config file path and modification time, so it is read again when the file changes (or when
+    another config file applies), and a changed host, user or domain gets its own session.
+    """
+    config = _read_config(*_config_stamp())
+    return get_session(config.host, config.username, config.password, config.domain)
+
+
+def _config_stamp() -> Tuple[Optional[str], Optional[int]]:
+    config_path = DefaultConfigProvider().get_config_path()
+    if config_path is None or not os.path.isfile(config_path):
+        return config_path, None
+    return config_path, os.stat(config_path).st_mtime_ns
+
+
+@lru_cache(maxsize=8)
+def _read_config(config_path: Optional[str], mtime_ns: Optional[int]) -> Any:  # pylint: disable=unused-argument
+    return Configuration(CloudShellConfigReader()).read()
+
+
+def worker_reservation_name(prefix: str = POOL_RESERVATION_PREFIX) -> str:
+    """Returns reservation name unique per pytest-xdist worker (PYTEST_XDIST_WORKER), "master" without xdist."""
+    return f"{prefix} {os.environ.get('PYTEST_XDIST_WORKER', 'master')}"
+
+
 def create_reservation(
     session: CloudShellAPISession,
     reservation_name: str,
@@ -82,22 +214,161 @@ def create_reservation(
     return reservation
 
 
-def end_named_reservations(session: CloudShellAPISession, reservation_name: str) -> None:
-    """End and delete reservation."""
-    reservations = session.GetCurrentReservations(reservationOwner=session.username)
-    for reservation in [r for r in reservations.Reservations if r.Name == reservation_name]:
-        end_reservation(session, reservation.Id)
+class TeardownResult(NamedTuple):
+    """Result of ending a single reservation."""
+
+    reservation_id: str
+    name: str
+    seconds: float
+    error: str = ""
+
+
+class CleanupResult(NamedTuple):
+    """Results of ending reservations concurrently."""
+
+    results: List[TeardownResult]
+    seconds: float
+
+    @property
+    def errors(self) -> List[TeardownResult]:
+        """Failed teardowns."""
+        return [result for result in self.results if result.error]
+
 
+def end_named_reservations(session: CloudShellAPISession, reservation_name: str, jobs: int = DEFAULT_TEARDOWN_JOBS) -> None:
+    """End and delete, concurrently, all reservations of the session user with the requested name."""
+    cleanup = cleanup_reservations(session, reservation_filter(name=reservation_name), jobs=jobs)
+    if cleanup.errors:
+        errors = "; ".join(f"{result.reservation_id}: {result.error}" for result in cleanup.errors)
+        raise RuntimeError(f"Failed to end reservations named {reservation_name} - {errors}")
 
-def end_reservation(session: CloudShellAPISession, reservation_id: str) -> None:
-    """End and delete reservation."""
+
+def cleanup_reservations(
+    session: CloudShellAPISession,
+    predicate: Callable[[ReservationShortInfo], bool],
+    owner: Optional[str] = None,
+    jobs: int = DEFAULT_TEARDOWN_JOBS,
+    timeout: float = END_RESERVATION_TIMEOUT,
+) -> CleanupResult:
+    """End and delete, concurrently, all current reservations that match the predicate.
+
+    :param predicate: Returns True for reservations to end, see reservation_filter.
+    :param owner: Owner of reservations to end, None means the session user, empty string means all owners.
+    :param jobs: Maximum number of reservations to end concurrently.
+    :param timeout: Maximum time, in seconds, to wait for each reservation teardown.
+    :return: Outcome per reservation (failures do not stop other teardowns) and total wall time.
+    """
+    start = time.monotonic()
+    owner = session.username if owner is None else owner
+    reservations = [r for r in session.GetCurrentReservations(reservationOwner=owner).Reservations if predicate(r)]
+    if not reservations:
+        return CleanupResult([], time.monotonic() - start)
+    with ThreadPoolExecutor(min(jobs, len(reservations))) as executor:
+        results = list(executor.map(lambda reservation: _end_reservation(session, reservation, timeout), reservations))
+    return CleanupResult(results, time.monotonic() - start)
+
+
+def reservation_filter(
+    name: Optional[str] = None, owner: Optional[str] = None, older_than: Optional[float] = None
+) -> Callable[[ReservationShortInfo], bool]:
+    """Returns predicate for cleanup_reservations, matching reservations that meet all requested criteria.
+
+    :param name: Reservation name, may be fnmatch pattern (e.g. "tg regression*").
+    :param owner: Reservation owner.
+    :param older_than: Minimum age, in seconds, since reservation start.
+    """
+
+    def predicate(reservation: ReservationShortInfo) -> bool:
+        if name is not None and not fnmatch(reservation.Name, name):
+            return False
+        if owner is not None and reservation.Owner != owner:
+            return False
+        if older_than is not None:
+            started = datetime.strptime(reservation.StartTime, RESERVATION_TIME_FORMAT).replace(tzinfo=timezone.utc)
+            if (datetime.now(timezone.utc) - started).total_seconds() < older_than:
+                return False
+        return True
+
+    return predicate
+
+
+def _end_reservation(session: CloudShellAPISession, reservation: ReservationShortInfo, timeout: float) -> TeardownResult:
+    start = time.monotonic()
+    try:
+        seconds = end_reservation(session, reservation.Id, timeout)
+    except Exception as error:  # pylint: disable=broad-except
+        return TeardownResult(reservation.Id, reservation.Name, time.monotonic() - start, repr(error))
+    return TeardownResult(reservation.Id, reservation.Name, seconds)
+
+
+def end_reservation(
+    session: CloudShellAPISession,
+    reservation_id: str,
+    timeout: float = END_RESERVATION_TIMEOUT,
+    interval: float = POLL_INTERVAL,
+) -> float:
+    """End reservation, wait for teardown to complete and delete reservation.
+
+    :param timeout: Maximum time, in seconds, to wait for teardown, raise TimeoutError when exceeded.
+    :param interval: First poll interval, in seconds, following intervals back off up to POLL_MAX_INTERVAL.
+    :return: Elapsed time, in seconds.
+    """
+    start = time.monotonic()
+    session.EndReservation(reservation_id)
+    wait_for(
+        lambda: session.GetReservationStatus(reservation_id).ReservationSlimStatus.Status == "Completed",
+        timeout,
+        interval,
+        f"reservation {reservation_id} teardown",
+    )
+    session.DeleteReservation(reservation_id)
+    return time.monotonic() - start
+
+
+def wait_for(condition: Callable[[], bool], timeout: float, interval: float = POLL_INTERVAL, description: str = "") -> float:
+    """Poll condition, with exponential backoff, until it is met.
+
+    :param condition: Returns True when the wait is over.
+    :param timeout: Maximum time, in seconds, to wait, raise TimeoutError when exceeded.
+    :param interval: First poll interval, in seconds, following intervals back off up to POLL_MAX_INTERVAL.
+    :param description: What we wait for, for the timeout error message.
+    :return: Elapsed time, in seconds.
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    while not condition():
+        now = time.monotonic()
+        if now >= deadline:
+            raise TimeoutError(f"Timeout waiting for {description or condition} after {now - start:.1f} seconds")
+        time.sleep(min(interval, deadline - now))
+        interval = min(interval * POLL_BACKOFF, POLL_MAX_INTERVAL)
+    return time.monotonic() - start
+
+
+class AutoloadResource(NamedTuple):
+    """Resource to create for Autoload testing."""
+
+    model: str
+    full_name: str
+    address: Optional[str] = "na"
+    attributes: Optional[list] = None
+
+
+class ProvisionResult(NamedTuple):
+    """Created resources and total seconds per provisioning phase."""
+
+    resources: List[ResourceInfo]
+    stages: Dict[str, float]
+
+
+@contextmanager
+def _stage(stages: Dict[str, float], name: str) -> Iterator[None]:
+    """Add the elapsed time, in seconds, of the enclosed block to stages[name] (local timing, not the global profiler)."""
+    start = time.perf_counter()
     try:
-        session.EndReservation(reservation_id)
-        while session.GetReservationDetails(reservation_id).ReservationDescription.Status != "Completed":
-            time.sleep(1)
-        session.DeleteReservation(reservation_id)
-    except Exception:  # pylint: disable=broad-except
-        pass
+        yield
+    finally:
+        stages[name] = stages.get(name, 0.0) + time.perf_counter() - start
 
 
 class TgTestHelpers:
@@ -112,24 +383,32 @@ class TgTestHelpers:
         self,
         topology_name: str,
         global_inputs: Optional[List[UpdateTopologyGlobalInputsRequest]] = None,
-        reservation_name: str = "tg regression tests",
+        reservation_name: Optional[str] = None,
     ) -> CreateReservationResponseInfo:
-        """Create new reservation from topology. End existing reservation with the same name if exist."""
+        """Create new reservation from topology. End existing reservation with the same name if exist.
+
+        :param reservation_name: Reservation name, if None the xdist worker default name (see worker_reservation_name).
+        """
+        reservation_name = reservation_name or worker_reservation_name()
         self.reservation = create_reservation(self.session, reservation_name, topology_name, global_inputs)
         self.reservation_id = self.reservation.Reservation.Id
         return self.reservation
 
-    def create_reservation(self, reservation_name: str = "tg regression tests") -> CreateReservationResponseInfo:
-        """Create new empty reservation. End existing reservation with the same name if exist."""
-        self.reservation = create_reservation(self.session, reservation_name)
+    def create_reservation(self, reservation_name: Optional[str] = None) -> CreateReservationResponseInfo:
+        """Create new empty reservation. End existing reservation with the same name if exist.
+
+        :param reservation_name: Reservation name, if None the xdist worker default name (see worker_reservation_name).
+        """
+        self.reservation = create_reservation(self.session, reservation_name or worker_reservation_name())
         self.reservation_id = self.reservation.Reservation.Id
         return self.reservation
 
-    def end_reservation(self) -> None:
-        """End and delete reservation."""
-        end_reservation(self.session, self.reservation_id)
+    def end_reservation(self, timeout: float = END_RESERVATION_TIMEOUT) -> float:
+        """End and delete reservation, returns elapsed time in seconds (see end_reservation)."""
+        seconds = end_reservation(self.session, self.reservation_id, timeout)
         self.reservation = None
         self.reservation_id = ""
+        return seconds
 
     def autoload_command_context(
         self, family: str, model: str, address: str, attributes: Optional[dict] = None
@@ -176,12 +455,11 @@ class TgTestHelpers:
         address: Optional[str] = "na",
         attributes: Optional[list] = None,
     ) -> ResourceInfo:
-        """Create resource for Autoload testing."""
+        """Create resource for Autoload testing, existing resource with the same name is deleted first."""
         folder = Path(full_name).parent.as_posix()
         name = Path(full_name).name
-        existing_resource = [r for r in self.session.GetResourceList().Resources if r.Name == name]
-        if existing_resource:
-            self.session.DeleteResource(existing_resource[0].Name)
+        if self.find_resource(name):
+            self.session.DeleteResource(name)
         resource = self.session.CreateResource(
             resourceModel=model,
             resourceName=name,
@@ -194,6 +472,42 @@ class TgTestHelpers:
             self.session.SetAttributesValues([ResourceAttributesUpdateRequest(full_name, attributes)])
         return resource
 
+    def create_autoload_resources(
+        self, resources: List[AutoloadResource], jobs: int = DEFAULT_PROVISION_JOBS
+    ) -> ProvisionResult:
+        """Create resources for Autoload testing, existing resources with the same names are deleted first.
+
+        Existing resources are deleted with a single request, resources are created concurrently and all attributes
+        are set with a single request.
+
+        :param jobs: Maximum number of resources to look up and create concurrently.
+        :return: Created resources, in requested order, and seconds per phase.
+        """
+        names = [Path(resource.full_name).name for resource in resources]
+        stages: Dict[str, float] = {}
+        with ThreadPoolExecutor(max(1, min(jobs, len(resources)))) as executor:
+            with _stage(stages, "find resources"):
+                existing = [name for name, found in zip(names, executor.map(self.find_resource, names)) if found]
+            if existing:
+                with _stage(stages, "delete resources"):
+                    self.session.DeleteResources(existing)
+            with _stage(stages, "create resources"):
+                created = list(executor.map(self._create_resource, resources))
+            updates = [
+                ResourceAttributesUpdateRequest(resource.full_name, resource.attributes)
+                for resource in resources
+                if resource.attributes
+            ]
+            if updates:
+                with _stage(stages, "set attributes"):
+                    self.session.SetAttributesValues(updates)
+        return ProvisionResult(created, stages)
+
+    def find_resource(self, name: str) -> Optional[FindResourceInfo]:
+        """Returns root resource by exact name, None if not found (server side search, not full resources list)."""
+        resources = self.session.FindResources(resourceFullName=name, exactName=True, includeSubResources=False).Resources
+        return next((resource for resource in resources if resource.Name == name), None)
+
     def attach_to_cloudshell_as(self, resource_name: Optional[str] = None, service_name: Optional[str] = None) -> None:
         """Mock ES behaviour on local machine so the test can create local objects such as contexts, sandboxes etc."""
         os.environ["DEVBOOTSTRAP"] = "True"
@@ -207,6 +521,17 @@ class TgTestHelpers:
             service_name=service_name,
         )
 
+    def _create_resource(self, resource: AutoloadResource) -> ResourceInfo:
+        created = self.session.CreateResource(
+            resourceModel=resource.model,
+            resourceName=Path(resource.full_name).name,
+            folderFullPath=Path(resource.full_name).parent.as_posix(),
+            resourceAddress=resource.address,
+            resourceDescription="should be removed after test",
+        )
+        self.session.UpdateResourceDriver(created.Name, resource.model)
+        return created
+
     def _conn_and_res(
         self,
         family: str,
@@ -244,12 +569,240 @@ class TgTestHelpers:
         return connectivity, resource
 
 
+class AsyncTgTestHelpers:
+    """asyncio facade over TgTestHelpers, blocking API calls run on a bounded executor with per call timeout.
+
+    A timed out call stops waiting for the API call but the API call itself completes on the executor thread.
+    """
+
+    def __init__(
+        self, session: CloudShellAPISession, executor: Optional[Executor] = None, timeout: float = ASYNC_CALL_TIMEOUT
+    ) -> None:
+        """Create helpers.
+
+        :param executor: Executor for blocking API calls, default is a shared pool of DEFAULT_ASYNC_JOBS threads.
+        :param timeout: Default timeout, in seconds, of a single helper call.
+        """
+        self.helpers = TgTestHelpers(session)
+        self.executor = executor or _default_executor()
+        self.timeout = timeout
+
+    @property
+    def reservation_id(self) -> str:
+        """Reservation ID, empty if there is no reservation."""
+        return self.helpers.reservation_id
+
+    async def create_topology_reservation(
+        self,
+        topology_name: str,
+        global_inputs: Optional[List[UpdateTopologyGlobalInputsRequest]] = None,
+        reservation_name: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> CreateReservationResponseInfo:
+        """See TgTestHelpers.create_topology_reservation."""
+        return await self._run(
+            partial(self.helpers.create_topology_reservation, topology_name, global_inputs, reservation_name),
+            self._timeout(timeout),
+        )
+
+    async def create_reservation(
+        self, reservation_name: Optional[str] = None, timeout: Optional[float] = None
+    ) -> CreateReservationResponseInfo:
+        """See TgTestHelpers.create_reservation."""
+        return await self._run(partial(self.helpers.create_reservation, reservation_name), self._timeout(timeout))
+
+    async def end_reservation(self, timeout: float = END_RESERVATION_TIMEOUT) -> float:
+        """See TgTestHelpers.end_reservation, the teardown timeout bounds the call."""
+        return await self._run(partial(self.helpers.end_reservation, timeout), None)
+
+    async def create_autoload_resource(
+        self,
+        model: str,
+        full_name: str,
+        address: Optional[str] = "na",
+        attributes: Optional[list] = None,
+        timeout: Optional[float] = None,
+    ) -> ResourceInfo:
+        """See TgTestHelpers.create_autoload_resource."""
+        return await self._run(
+            partial(self.helpers.create_autoload_resource, model, full_name, address, attributes), self._timeout(timeout)
+        )
+
+    async def _run(self, call: Callable[[], Any], timeout: Optional[float]) -> Any:
+        """Run blocking call on the executor, timeout None means no timeout."""
+        return await asyncio.wait_for(asyncio.get_running_loop().run_in_executor(self.executor, call), timeout)
+
+    def _timeout(self, timeout: Optional[float]) -> float:
+        return self.timeout if timeout is None else timeout
+
+
+async def gather_reservations(
+    session: CloudShellAPISession,
+    reservation_names: List[str],
+    topology_name: Optional[str] = None,
+    global_inputs: Optional[List[UpdateTopologyGlobalInputsRequest]] = None,
+    executor: Optional[Executor] = None,
+) -> List[AsyncTgTestHelpers]:
+    """Create reservations concurrently, one per (unique) name, returns helpers in names order.
+
+    On failure, reservations that were created are ended before the error is raised.
+    """
+    helpers = [AsyncTgTestHelpers(session, executor) for _ in reservation_names]
+    if topology_name:
+        creations = [
+            helper.create_topology_reservation(topology_name, global_inputs, name)
+            for helper, name in zip(helpers, reservation_names)
+        ]
+    else:
+        creations = [helper.create_reservation(name) for helper, name in zip(helpers, reservation_names)]
+    results = await asyncio.gather(*creations, return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        await end_reservations([helper for helper in helpers if helper.reservation_id])
+        raise errors[0]
+    return helpers
+
+
+async def end_reservations(helpers: List[AsyncTgTestHelpers]) -> List[float]:
+    """End reservations concurrently, returns elapsed time per reservation, raise the first failure after all ended."""
+    results = await asyncio.gather(*[helper.end_reservation() for helper in helpers], return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        raise errors[0]
+    return results
+
+
+def _default_executor() -> ThreadPoolExecutor:
+    global _executor  # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(DEFAULT_ASYNC_JOBS, thread_name_prefix="tg-test-helpers")
+        return _executor
+
+
+class ReservationPool:
+    """Reservations created once and leased by tests, per topology and global inputs, ended on close.
+
+    Reservation names are unique per pytest-xdist worker (PYTEST_XDIST_WORKER), so parallel workers do not interfere.
+    """
+
+    def __init__(
+        self,
+        session: CloudShellAPISession,
+        reset: Optional[Callable[[TgTestHelpers], None]] = None,
+        prefix: str = POOL_RESERVATION_PREFIX,
+    ) -> None:
+        """Create empty pool.
+
+        :param reset: Called with the leased reservation helpers when the lease is returned, to restore the reservation
+            state. If reset fails, the reservation is ended instead of returned to the pool. If None, reservations are
+            returned to the pool as is, with anything the previous test added.
+        :param prefix: Reservation names prefix.
+        """
+        self.session = session
+        self.reset = reset
+        self.prefix = worker_reservation_name(prefix)
+        self.idle: Dict[Tuple, List[TgTestHelpers]] = {}
+        self.leased: List[TgTestHelpers] = []
+        self._created = 0
+        self._lock = Lock()
+
+    def warm(
+        self,
+        count: int,
+        topology_name: Optional[str] = None,
+        global_inputs: Optional[List[UpdateTopologyGlobalInputsRequest]] = None,
+    ) -> None:
+        """Create, concurrently, count idle reservations for the topology (empty reservations if None)."""
+        with ThreadPoolExecutor(max(1, min(count, DEFAULT_TEARDOWN_JOBS))) as executor:
+            helpers = list(executor.map(lambda _: self._create(topology_name, global_inputs), range(count)))
+        with self._lock:
+            self.idle.setdefault(_pool_key(topology_name, global_inputs), []).extend(helpers)
+
+    @contextmanager
+    def lease(
+        self, topology_name: Optional[str] = None, global_inputs: Optional[List[UpdateTopologyGlobalInputsRequest]] = None
+    ) -> Iterator[TgTestHelpers]:
+        """Yields helpers of an idle reservation of the topology, created if there is no idle reservation.
+
+        On exit the reservation is reset and returned to the pool.
+        """
+        key = _pool_key(topology_name, global_inputs)
+        with self._lock:
+            idle = self.idle.get(key)
+            helpers = idle.pop() if idle else None
+        if not helpers:
+            helpers = self._create(topology_name, global_inputs)
+        with self._lock:
+            self.leased.append(helpers)
+        try:
+            yield helpers
+        finally:
+            self._release(key, helpers)
+
+    def close(self) -> List[float]:
+        """End, concurrently, all pool reservations, returns elapsed time per reservation."""
+        with self._lock:
+            helpers = [helper for idle in self.idle.values() for helper in idle] + self.leased
+            self.idle, self.leased = {}, []
+        if not helpers:
+            return []
+        with ThreadPoolExecutor(min(DEFAULT_TEARDOWN_JOBS, len(helpers))) as executor:
+            return list(executor.map(lambda helper: helper.end_reservation(), helpers))
+
+    def _create(
+        self, topology_name: Optional[str], global_inputs: Optional[List[UpdateTopologyGlobalInputsRequest]]
+    ) -> TgTestHelpers:
+        with self._lock:
+            self._created += 1
+            reservation_name = f"{self.prefix} {self._created}"
+        helpers = TgTestHelpers(self.session)
+        if topology_name:
+            helpers.create_topology_reservation(topology_name, global_inputs, reservation_name)
+        else:
+            helpers.create_reservation(reservation_name)
+        return helpers
+
+    def _release(self, key: Tuple, helpers: TgTestHelpers) -> None:
+        try:
+            if self.reset:
+                self.reset(helpers)
+        except Exception:
+            with self._lock:
+                self.leased.remove(helpers)
+            helpers.end_reservation()
+            raise
+        with self._lock:
+            self.leased.remove(helpers)
+            self.idle.setdefault(key, []).append(helpers)
+
+
+def _pool_key(topology_name: Optional[str], global_inputs: Optional[List[UpdateTopologyGlobalInputsRequest]]) -> Tuple:
+    return topology_name, tuple(sorted((request.ParamName, request.Value) for request in global_inputs or []))
+
+
 @pytest.fixture(scope="session")
 def session() -> CloudShellAPISession:
     """Yield session."""
     return create_session_from_config()
 
 
+@pytest.fixture(scope="session")
+def reservation_pool(session: CloudShellAPISession) -> Iterable[ReservationPool]:
+    """Yield reservation pool of the test session (xdist worker), all pool reservations are ended at session end.
+
+    The pool is warmed with TG_RESERVATION_POOL_WARM empty reservations (none by default), created concurrently.
+    """
+    pool = ReservationPool(session)
+    try:
+        warm = int(os.environ.get(RESERVATION_POOL_WARM_ENV, "0"))
+        if warm > 0:
+            pool.warm(warm)
+        yield pool
+    finally:
+        pool.close()
+
+
 @pytest.fixture()
 def test_helpers(session: CloudShellAPISession) -> Iterable[TgTestHelpers]:
     """Yield initialized TestHelpers object."""
@@ -259,6 +812,17 @@ def test_helpers(session: CloudShellAPISession) -> Iterable[TgTestHelpers]:
     test_helpers.end_reservation()
 
 
+@pytest.fixture()
+def pooled_test_helpers(reservation_pool: ReservationPool) -> Iterable[TgTestHelpers]:
+    """Yield initialized TestHelpers object with an empty reservation leased from the reservation pool.
+
+    Opt-in alternative to test_helpers for tests that do not depend on a clean reservation. The reservation is reused
+    by later tests as is, override reservation_pool with a pool that has a reset to restore it between tests.
+    """
+    with reservation_pool.lease() as test_helpers:
+        yield test_helpers
+
+
 @pytest.fixture
 def skip_if_offline(server: list) -> None:
     """Skip test on offline ports."""
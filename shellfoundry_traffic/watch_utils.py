@@ -0,0 +1,122 @@
+"""
+Shellfoundry traffic watch utilities.
+
+Uses watchdog (inotify, FSEvents, ReadDirectoryChangesW) when installed (pip install shellfoundry-traffic[watch]),
+otherwise polls files modification times.
+"""
+import os
+import time
+from pathlib import Path
+from queue import Empty, Queue
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+WATCHED_EVENTS = ["created", "deleted", "modified", "moved"]
+
+
+class ChangeWatcher:
+    """Watch files and folders (recursively) for changes and report debounced bursts of changes."""
+
+    def __init__(self, paths: List[Path], debounce: float = 0.5, poll_interval: float = 0.5, polling: bool = False) -> None:
+        """Start watching.
+
+        :param paths: Files and folders to watch.
+        :param debounce: Changes are collected until there are no new changes for debounce seconds.
+        :param poll_interval: Interval, in seconds, between polls when watchdog is not available.
+        :param polling: If True, poll even if watchdog is available.
+        """
+        self.paths = [path.resolve() for path in paths]
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.events: "Queue[Path]" = Queue()
+        self.observer: Any = None if polling else self._start_observer()
+        self.snapshot = {} if self.observer else self._snapshot()
+
+    def wait(self, timeout: Optional[float] = None) -> Set[Path]:
+        """Block until changes are detected, then collect changes until quiet for debounce seconds.
+
+        :param timeout: Maximum time, in seconds, to wait for the first change, None means wait forever.
+        :return: Changed files, empty set on timeout.
+        """
+        changes = self._next_changes(timeout)
+        while changes:
+            more_changes = self._next_changes(self.debounce)
+            if not more_changes:
+                break
+            changes |= more_changes
+        return changes
+
+    def stop(self) -> None:
+        """Stop watching."""
+        if self.observer:
+            self.observer.stop()
+            self.observer.join()
+
+    def dispatch(self, event: Any) -> None:
+        """watchdog event handler."""
+        if event.is_directory or event.event_type not in WATCHED_EVENTS:
+            return
+        for path in [event.src_path, getattr(event, "dest_path", "")]:
+            if path and self._is_watched(Path(os.fsdecode(path)).resolve()):
+                self.events.put(Path(os.fsdecode(path)).resolve())
+
+    def _start_observer(self) -> Any:
+        try:
+            # pylint: disable=import-outside-toplevel
+            from watchdog.observers import Observer
+        except ImportError:
+            return None
+        observer = Observer()
+        for path in self.paths:
+            if path.is_dir():
+                observer.schedule(self, path.as_posix(), recursive=True)
+            else:
+                observer.schedule(self, path.parent.as_posix(), recursive=False)
+        observer.start()
+        return observer
+
+    def _next_changes(self, timeout: Optional[float]) -> Set[Path]:
+        if self.observer:
+            try:
+                changes = {self.events.get(timeout=timeout)}
+            except Empty:
+                return set()
+            while not self.events.empty():
+                changes.add(self.events.get_nowait())
+            return changes
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self._snapshot()
+            changes = {
+                path for path in snapshot.keys() | self.snapshot.keys() if snapshot.get(path) != self.snapshot.get(path)
+            }
+            self.snapshot = snapshot
+            if changes:
+                return changes
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            time.sleep(
+                self.poll_interval if deadline is None else max(0, min(self.poll_interval, deadline - time.monotonic()))
+            )
+
+    def _is_watched(self, path: Path) -> bool:
+        if "__pycache__" in path.parts or path.suffix == ".pyc":
+            return False
+        return any(path == watched or watched in path.parents for watched in self.paths)
+
+    def _snapshot(self) -> Dict[Path, Tuple[int, int]]:
+        files: List[Path] = []
+        for path in self.paths:
+            if path.is_dir():
+                for root, dirs, folder_files in os.walk(path):
+                    dirs[:] = [folder for folder in dirs if folder != "__pycache__"]
+                    files.extend(Path(root).joinpath(file) for file in folder_files if not file.endswith(".pyc"))
+            elif path.exists():
+                files.append(path)
+        snapshot = {}
+        for file in files:
+            try:
+                stat = file.stat()
+            except FileNotFoundError:
+                continue
+            snapshot[file] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
@@ -0,0 +1,444 @@
+"""
+Local, in process, stand-in for the CloudShell server APIs used by shellfoundry traffic and its test helpers.
+
+A single local port serves both APIs:
+- XML API (CloudShellAPISession) - logon, reservations, resources and scripts.
+- Packaging REST API (PackagingRestApiClient) - login, shells and standards, and driver data model generate.
+
+Latency and failures can be injected per operation, so polling, retries and concurrency can be tested and benchmarked
+deterministically without a live server.
+"""
+import base64
+import json
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape, quoteattr
+from zipfile import ZipFile
+
+import yaml
+
+# CloudShellAPISession default datetimeformat (MM/dd/yyyy HH:mm) and timezone (UTC).
+TIME_FORMAT = "%m/%d/%Y %H:%M"
+# Same as test_helpers.INVALID_TOKEN_ERROR_CODES, generic API errors use code 100.
+INVALID_TOKEN_ERROR_CODE = "105"
+RESPONSE_XML = '<Response CommandName="{}" Success="{}" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">{}</Response>'
+# Minimal generated data model class per node type, named as the node type last part (as shellfoundry generate does).
+DATA_MODEL_CLASS = """class {name}(object):
+    def __init__(self, name):
+        self.attributes = {{}}
+        self.resources = {{}}
+        self._cloudshell_model_name = '{name}'
+        self._name = name
+"""
+
+
+class StandInError(Exception):
+    """API error returned to the client (CloudShellAPIError on the client side)."""
+
+    def __init__(self, message: str, code: str = "100", transient: bool = False) -> None:
+        """Create error.
+
+        :param transient: If True, the connection is dropped without response (network failure on the client side).
+        """
+        super().__init__(message)
+        self.message = message
+        self.code = code
+        self.transient = transient
+
+
+class CloudShellStandIn:  # pylint: disable=too-many-instance-attributes
+    """Stand-in CloudShell server, state is kept in plain dicts that tests can inspect and modify."""
+
+    def __init__(self, latency: float = 0, teardown_seconds: float = 0, username: str = "admin", password: str = "admin"):
+        """Create stand-in, call start (or use as context manager) to serve.
+
+        :param latency: Default delay, in seconds, of every request.
+        :param teardown_seconds: Time, in seconds, from EndReservation until the reservation status is Completed.
+        :param username: The only valid user name.
+        :param password: The only valid password.
+        """
+        self.host = "127.0.0.1"
+        self.port = 0
+        self.latency = latency
+        self.teardown_seconds = teardown_seconds
+        self.credentials = (username, password)
+        self.latencies: Dict[str, float] = {}
+        self.failures: Dict[str, List[StandInError]] = {}
+        self.requests: List[str] = []
+        self.tokens: Set[str] = set()
+        self.reservations: Dict[str, Dict[str, Any]] = {}
+        self.resources: Dict[str, Dict[str, Any]] = {}
+        self.scripts: Dict[str, bytes] = {}
+        self.shells: Dict[str, int] = {}
+        self.official_shells: Set[str] = set()
+        self.standards: List[Dict[str, Any]] = []
+        self._lock = Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._operations: Dict[str, Callable[[Dict[str, Any]], str]] = {
+            "Logon": self._logon,
+            "GetCurrentReservations": self._get_current_reservations,
+            "CreateImmediateReservation": self._create_reservation,
+            "EndReservation": self._end_reservation,
+            "GetReservationStatus": self._get_reservation_status,
+            "GetReservationDetails": self._get_reservation_details,
+            "DeleteReservation": self._delete_reservation,
+            "GetResourceList": self._get_resource_list,
+            "FindResources": self._find_resources,
+            "GetResourceDetails": self._get_resource_details,
+            "CreateResource": self._create_resource,
+            "DeleteResource": self._delete_resources,
+            "DeleteResources": self._delete_resources,
+            "UpdateResourceDriver": self._update_resource_driver,
+            "SetAttributesValues": self._set_attributes_values,
+            "UpdateScript": self._update_script,
+        }
+
+    def __enter__(self) -> "CloudShellStandIn":
+        return self.start()
+
+    def __exit__(self, *_: Any) -> None:
+        self.stop()
+
+    @property
+    def server(self) -> Dict[str, Any]:
+        """Server profile of the stand-in, as in install --servers yaml."""
+        return {"host": self.host, "port": self.port, "username": self.credentials[0], "password": self.credentials[1]}
+
+    def start(self) -> "CloudShellStandIn":
+        """Start serving on a free local port."""
+        self._server = ThreadingHTTPServer((self.host, 0), _StandInHandler)
+        self._server.stand_in = self  # type: ignore[attr-defined]
+        self.port = self._server.server_port
+        Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving."""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def fail(
+        self, operation: str, count: int = 1, message: str = "Injected failure", code: str = "100", transient: bool = False
+    ) -> None:
+        """Fail the next count requests of the operation.
+
+        :param operation: XML API method name (e.g. EndReservation) or REST operation (Login, AddShell, UpdateShell,
+            GetShell, DeleteShell, GetStandards, Generate).
+        :param transient: If True, drop the connection instead of returning an API error.
+        """
+        with self._lock:
+            self.failures.setdefault(operation, []).extend(StandInError(message, code, transient) for _ in range(count))
+
+    def expire_tokens(self) -> None:
+        """Invalidate all tokens, following XML API requests fail until the client logs in again."""
+        with self._lock:
+            self.tokens.clear()
+
+    def add_resource(self, name: str, model: str = "Generic Chassis", folder: str = "", address: str = "na") -> None:
+        """Add root resource."""
+        with self._lock:
+            self.resources[name] = {"model": model, "folder": folder, "address": address, "attributes": {}}
+
+    def call(self, operation: str, run: Callable[[], Any]) -> Any:
+        """Record the request, apply latency and injected failures, then run the operation."""
+        with self._lock:
+            self.requests.append(operation)
+            failures = self.failures.get(operation)
+            failure = failures.pop(0) if failures else None
+        time.sleep(self.latencies.get(operation, self.latency))
+        if failure:
+            raise failure
+        return run()
+
+    def api_request(self, operation: str, token: str, request: ElementTree.Element) -> str:
+        """Returns XML API response info for the request, raise StandInError on failure."""
+        if operation not in self._operations:
+            raise StandInError(f"{operation} is not supported by the stand-in", "404")
+        if operation != "Logon" and token not in self.tokens:
+            raise StandInError("Token is invalid or expired, please login again", INVALID_TOKEN_ERROR_CODE)
+        args = {child.tag: (child.text or "") if len(child) == 0 else child for child in request}
+        with self._lock:
+            return self._operations[operation](args)
+
+    def rest_request(self, operation: str, path: str, body: bytes) -> Tuple[int, Any]:
+        """Returns HTTP status and json (or zip) response of packaging REST API request, raise StandInError on failure."""
+        if operation == "Login":
+            return 200, self._login(body)
+        if operation == "GetStandards":
+            return 200, self.standards
+        if operation == "Generate":
+            return 200, _generate_data_model(body)
+        if operation == "Unknown":
+            return 404, None
+        parts = path.strip("/").split("/")
+        name = parts[2] if len(parts) > 2 else body.split(b'filename="')[1].split(b'"')[0].decode().rsplit(".", 1)[0]
+        with self._lock:
+            return self._shell_request(operation, name, body)
+
+    def _shell_request(self, operation: str, name: str, body: bytes) -> Tuple[int, Any]:
+        """Add, update, delete or get shell - add fails if the shell exists, the others fail if it does not exist."""
+        if (operation == "AddShell") == (name in self.shells):
+            return {"AddShell": 400, "UpdateShell": 404}.get(operation, 400), f"Shell {name} {operation} failed"
+        if operation in ["AddShell", "UpdateShell"]:
+            self.shells[name] = len(body)
+            self.official_shells.discard(name)
+        elif operation == "DeleteShell":
+            del self.shells[name]
+        shell_info = {"Name": name, "IsOfficial": name in self.official_shells}
+        return {"AddShell": 201}.get(operation, 200), shell_info if operation == "GetShell" else None
+
+    def _login(self, body: bytes) -> Optional[str]:
+        form = dict(field.split("=", 1) for field in body.decode().split("&"))
+        if (form.get("username"), form.get("password")) != self.credentials:
+            raise StandInError("Login failed", "401")
+        token = uuid.uuid4().hex
+        with self._lock:
+            self.tokens.add(token)
+        return token
+
+    def _logon(self, args: Dict[str, Any]) -> str:
+        if (args["username"], args["password"]) != self.credentials:
+            raise StandInError("Login failed, invalid user name or password", "101")
+        token = uuid.uuid4().hex
+        self.tokens.add(token)
+        return _info("LogonResponseInfo", f'<Token Token="{token}"/><Domain DomainId="1"/>')
+
+    def _get_current_reservations(self, args: Dict[str, Any]) -> str:
+        owner = args["reservationOwner"]
+        reservations = [reservation for reservation in self.reservations.values() if owner in ["", reservation["Owner"]]]
+        elements = "".join(_element("ReservationShortInfo", self._status(reservation)) for reservation in reservations)
+        return _info("GetActiveReservationsResponseInfo", f"<Reservations>{elements}</Reservations>")
+
+    def _create_reservation(self, args: Dict[str, Any]) -> str:
+        start = datetime.now(timezone.utc)
+        reservation = {
+            "Id": str(uuid.uuid4()),
+            "Name": args["reservationName"],
+            "Owner": args["owner"],
+            "Status": "Started",
+            "StartTime": start.strftime(TIME_FORMAT),
+            "EndTime": (start + timedelta(minutes=int(args["durationInMinutes"] or 0))).strftime(TIME_FORMAT),
+            "Booked": "true",
+            "topology": args.get("topologyFullPath", ""),
+        }
+        self.reservations[reservation["Id"]] = reservation
+        return _info("CreateReservationResponseInfo", _element("Reservation", reservation))
+
+    def _end_reservation(self, args: Dict[str, Any]) -> str:
+        reservation = self._reservation(args["reservationId"])
+        if reservation["Status"] == "Started":
+            reservation["Status"] = "Teardown"
+            reservation["completed"] = time.monotonic() + self.teardown_seconds
+        return ""
+
+    def _get_reservation_status(self, args: Dict[str, Any]) -> str:
+        status = self._status(self._reservation(args["reservationId"]))
+        return _info("ReservationSlimStatusInfo", _element("ReservationSlimStatus", status))
+
+    def _get_reservation_details(self, args: Dict[str, Any]) -> str:
+        status = self._status(self._reservation(args["reservationId"]))
+        description = _element("ReservationDescription", status)
+        return _info("GetReservationDescriptionResponseInfo", description)
+
+    def _delete_reservation(self, args: Dict[str, Any]) -> str:
+        if self._status(self._reservation(args["reservationId"]))["Status"] != "Completed":
+            raise StandInError("Active reservation can not be deleted")
+        del self.reservations[args["reservationId"]]
+        return ""
+
+    def _get_resource_list(self, _: Dict[str, Any]) -> str:
+        return _resources_info("ResourceListInfo", "ResourceShortInfo", self.resources)
+
+    def _find_resources(self, args: Dict[str, Any]) -> str:
+        name = args["resourceFullName"]
+        exact = args["exactName"] == "true"
+        found = {key: value for key, value in self.resources.items() if key == name or not exact and name in key}
+        return _resources_info("FindResourceListInfo", "FindResourceInfo", found)
+
+    def _get_resource_details(self, args: Dict[str, Any]) -> str:
+        name = self._resource_name(args["resourceFullPath"])
+        resource = self.resources[name]
+        attributes = "".join(
+            _element("ResourceAttribute", {"Name": key, "Value": value}) for key, value in resource["attributes"].items()
+        )
+        info = {"Name": name, "ResourceModelName": resource["model"], "Address": resource["address"]}
+        return _info("ResourceInfo", f"<ResourceAttributes>{attributes}</ResourceAttributes>", info)
+
+    def _create_resource(self, args: Dict[str, Any]) -> str:
+        name = args["resourceName"]
+        if name in self.resources:
+            raise StandInError(f"Resource {name} already exists")
+        self.resources[name] = {
+            "model": args["resourceModel"],
+            "folder": args["folderFullPath"],
+            "address": args["resourceAddress"],
+            "attributes": {},
+        }
+        return _info("ResourceInfo", "", {"Name": name, "Address": args["resourceAddress"]})
+
+    def _delete_resources(self, args: Dict[str, Any]) -> str:
+        paths = [args["resourceFullPath"]] if "resourceFullPath" in args else [path.text for path in args["resourcesFullPath"]]
+        names = [self._resource_name(path) for path in paths]
+        for name in names:
+            del self.resources[name]
+        return ""
+
+    def _update_resource_driver(self, args: Dict[str, Any]) -> str:
+        self._resource_name(args["resourceFullPath"])
+        return ""
+
+    def _set_attributes_values(self, args: Dict[str, Any]) -> str:
+        for update in args["resourcesAttributesUpdateRequests"]:
+            name = self._resource_name(update.findtext("ResourceFullName", ""))
+            for attribute in update.find("AttributeNamesValues") or []:
+                self.resources[name]["attributes"][attribute.findtext("Name")] = attribute.findtext("Value", "")
+        return ""
+
+    def _update_script(self, args: Dict[str, Any]) -> str:
+        if args["scriptName"] not in self.scripts:
+            raise StandInError(f"Script {args['scriptName']} not found")
+        self.scripts[args["scriptName"]] = base64.b64decode(args["scriptFile"])
+        return ""
+
+    def _reservation(self, reservation_id: str) -> Dict[str, Any]:
+        if reservation_id not in self.reservations:
+            raise StandInError(f"Reservation {reservation_id} not found")
+        return self.reservations[reservation_id]
+
+    def _status(self, reservation: Dict[str, Any]) -> Dict[str, Any]:
+        """Returns reservation public attributes, teardown completes teardown_seconds after EndReservation."""
+        if reservation["Status"] == "Teardown" and time.monotonic() >= reservation["completed"]:
+            reservation["Status"] = "Completed"
+        return {key: value for key, value in reservation.items() if key[0].isupper()}
+
+    def _resource_name(self, path: str) -> str:
+        """Returns name of the resource with the path - name or folder/name."""
+        if path in self.resources:
+            return path
+        folder, _, name = path.rpartition("/")
+        if name in self.resources and self.resources[name]["folder"] == folder:
+            return name
+        raise StandInError(f"Resource {path} not found")
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """Routes XML API requests (POST /ResourceManagerApiService/<method>) and REST API requests (/API/...)."""
+
+    server: Any
+
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        """XML API request or add shell."""
+        if not self.path.startswith("/ResourceManagerApiService/"):
+            self._rest("POST")
+            return
+        operation = self.path.split("/")[-1]
+        request = ElementTree.fromstring(self._body())
+        token = self.headers.get("Authorization", "").split("Token=")[-1]
+        try:
+            info = self.server.stand_in.call(operation, lambda: self.server.stand_in.api_request(operation, token, request))
+            response = RESPONSE_XML.format(operation, "true", info)
+        except StandInError as error:
+            if error.transient:
+                self.close_connection = True
+                return
+            error_xml = f"<ErrorCode>{error.code}</ErrorCode><Error>{escape(error.message)}</Error>"
+            response = RESPONSE_XML.format(operation, "false", error_xml)
+        self._reply(200, response.encode())
+
+    def do_PUT(self) -> None:  # pylint: disable=invalid-name
+        """Login or update shell."""
+        self._rest("PUT")
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """Get shell or standards."""
+        self._rest("GET")
+
+    def do_DELETE(self) -> None:  # pylint: disable=invalid-name
+        """Delete shell."""
+        self._rest("DELETE")
+
+    def log_message(self, *args: str) -> None:  # pylint: disable=arguments-differ
+        pass
+
+    def _rest(self, method: str) -> None:
+        stand_in = self.server.stand_in
+        body = self._body()
+        operation = _rest_operation(method, self.path)
+        try:
+            status, response = stand_in.call(operation, lambda: stand_in.rest_request(operation, self.path, body))
+        except StandInError as error:
+            if error.transient:
+                self.close_connection = True
+            else:
+                self._reply(401 if error.code == "401" else 500, error.message.encode())
+            return
+        if not isinstance(response, bytes):
+            response = json.dumps(response).encode() if response is not None else b""
+        self._reply(status, response)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _reply(self, status: int, body: bytes = b"") -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _rest_operation(method: str, path: str) -> str:
+    parts = path.strip("/").split("/")
+    if parts == ["API", "Auth", "Login"]:
+        return "Login"
+    if parts == ["API", "Standards"]:
+        return "GetStandards"
+    if parts == ["API", "ShellDrivers", "Generate"]:
+        return "Generate"
+    if parts[:2] != ["API", "Shells"]:
+        return "Unknown"
+    return {"POST": "AddShell", "PUT": "UpdateShell", "GET": "GetShell", "DELETE": "DeleteShell"}[method]
+
+
+def _generate_data_model(body: bytes) -> bytes:
+    """Returns zip with data_model.py, one class per node type of the shell package uploaded as multipart form file."""
+    with ZipFile(BytesIO(body.split(b"\r\n\r\n", 1)[1].rsplit(b"\r\n--", 1)[0])) as shell_zip:
+        tosca_meta = shell_zip.read("TOSCA-Metadata/TOSCA.meta").decode().splitlines()
+        entry_definitions = dict(line.split(": ", 1) for line in tosca_meta if ": " in line)["Entry-Definitions"]
+        shell_definition = yaml.safe_load(shell_zip.read(entry_definitions))
+    classes = [DATA_MODEL_CLASS.format(name=node_type.split(".")[-1]) for node_type in shell_definition["node_types"]]
+    generated = BytesIO()
+    with ZipFile(generated, "w") as generated_zip:
+        generated_zip.writestr("data_model.py", "\n\n".join(classes))
+    return generated.getvalue()
+
+
+def _info(info_type: str, content: str, attributes: Optional[Dict[str, Any]] = None) -> str:
+    """Returns ResponseInfo element of the requested type (response class name)."""
+    return f'<ResponseInfo xsi:type="{info_type}" {_attributes(attributes or {})}>{content}</ResponseInfo>'
+
+
+def _element(tag: str, attributes: Dict[str, Any]) -> str:
+    return f"<{tag} {_attributes(attributes)}/>"
+
+
+def _attributes(attributes: Dict[str, Any]) -> str:
+    return " ".join(f"{key}={quoteattr(str(value))}" for key, value in attributes.items())
+
+
+def _resources_info(info_type: str, resource_type: str, resources: Dict[str, Dict[str, Any]]) -> str:
+    elements = "".join(
+        _element(
+            resource_type,
+            {"Name": name, "FullPath": name, "ResourceModelName": resource["model"], "Address": resource["address"]},
+        )
+        for name, resource in resources.items()
+    )
+    return _info(info_type, f"<Resources>{elements}</Resources>")
@@ -0,0 +1,6 @@
+"""
+Shared test configuration.
+
+pytest puts this folder on sys.path, so tests here and under shell and script import the local CloudShell stand-in
+(cloudshell_stand_in), which is a test utility and is not shipped with the package.
+"""
@@ -2,18 +2,29 @@
 Test cloudshell_traffic script CLI command.
 """
 # pylint: disable=redefined-outer-name
+import base64
 import os
 import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from types import SimpleNamespace
 from typing import Iterable, List
+from unittest.mock import Mock
 from zipfile import ZipFile
 
 import pytest
 import yaml
 from _pytest.fixtures import SubRequest
+from cloudshell.api.common_cloudshell_api import CloudShellAPIError
+from cloudshell_stand_in import CloudShellStandIn
 
-from shellfoundry_traffic.script_utils import SRC_DIR, ScriptCommandExecutor
-from shellfoundry_traffic.shellfoundry_traffic_cmd import main
+from shellfoundry_traffic.exclude_utils import ExcludeMatcher
+from shellfoundry_traffic.script_utils import ScriptCommandExecutor, upload_script
+from shellfoundry_traffic.shellfoundry_traffic_cmd import main, script_all
+from shellfoundry_traffic.test_helpers import clear_sessions, get_session
+
+SRC_DIR = Path(__file__).parent.joinpath("src")
 
 
 @pytest.fixture
@@ -49,20 +60,200 @@ def test_script(dist: Path, script_definition_yaml: str) -> None:
     assert excluded_files[0] not in _get_script_zip(dist, script_definition_yaml).filelist
 
 
-def test_get_main(script_definition_yaml: str) -> None:
-    """Test get_main method."""
-    os.chdir(Path(__file__).parent)
-    with open(SRC_DIR.joinpath("__main__.py"), "w"):
-        pass
+def test_get_main(dist: Path, script_definition_yaml: str) -> None:
+    """Test that the selected main module is zipped as __main__.py and the source tree is not modified."""
+    original_main = SRC_DIR.joinpath("__main__.py").read_bytes()
     script_command = ScriptCommandExecutor(script_definition=script_definition_yaml)
-    script_command.get_main()
-    script_definition = _get_script_definition(script_definition_yaml)
-    new_main_file_name = script_definition["files"]["main"]
-    with open(SRC_DIR.joinpath(new_main_file_name), "r") as new_main_file:
-        new_main_content = new_main_file.read()
-    with open(SRC_DIR.joinpath("__main__.py"), "r") as main_file:
-        existing_main_content = main_file.read()
-    assert new_main_content == existing_main_content
+    new_main_file_name = _get_script_definition(script_definition_yaml)["files"]["main"]
+    assert script_command.get_main() == SRC_DIR.joinpath(new_main_file_name)
+    script_command.zip_files()
+    with ZipFile(script_command.script_zip) as script_zip:
+        assert script_zip.read("__main__.py") == SRC_DIR.joinpath(new_main_file_name).read_bytes()
+        assert script_zip.namelist().count("__main__.py") == 1
+    assert SRC_DIR.joinpath("__main__.py").read_bytes() == original_main
+
+
+def test_zip_files(dist: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that zip keeps nested packages structure and prunes excluded directories."""
+    src = tmp_path.joinpath("src")
+    files = ["__main__.py", "exclude.txt", "pkg/__init__.py", "pkg/sub/module.py", "pkg/sub/exclude.txt", "data/keep.log"]
+    files += ["data/drop.log", "pkg/__pycache__/module.cpython-39.pyc", ".venv/lib/site.py", "tests/test_script.py"]
+    for file in files:
+        src.joinpath(file).parent.mkdir(parents=True, exist_ok=True)
+        src.joinpath(file).write_text(file)
+    script_definition_yaml = tmp_path.joinpath("script-definition.yaml")
+    excludes = ["exclude.txt", "tests/", "*.log", "!keep.log"]
+    script_definition_yaml.write_text(yaml.safe_dump({"metadata": {"script_name": "Nested"}, "files": {"exclude": excludes}}))
+    walked: List[str] = []
+    walk = os.walk
+    monkeypatch.setattr("os.walk", lambda top: ((walked.append(Path(entry[0]).name) or entry) for entry in walk(top)))
+    ScriptCommandExecutor(script_definition_yaml.as_posix(), src_dir=src).zip_files()
+    with ZipFile(dist.joinpath("Nested.zip")) as script_zip:
+        assert script_zip.namelist() == ["__main__.py", "data/keep.log", "pkg/__init__.py", "pkg/sub/module.py"]
+        assert script_zip.read("pkg/sub/module.py") == b"pkg/sub/module.py"
+    assert "sub" in walked and not {"__pycache__", ".venv", "tests"} & set(walked)
+
+
+def test_zip_reproducible(dist: Path, script_definition_yaml: str) -> None:
+    """Test that zipping the same sources gives the same zip, regardless of files timestamps."""
+    script_command = ScriptCommandExecutor(script_definition_yaml)
+    script_command.zip_files()
+    first_zip = script_command.script_zip.read_bytes()
+    script_stat = SRC_DIR.joinpath("script.py").stat()
+    os.utime(SRC_DIR.joinpath("script.py"), (script_stat.st_atime, script_stat.st_mtime - 24 * 60 * 60))
+    script_command.zip_files()
+    assert script_command.script_zip.read_bytes() == first_zip
+
+
+def test_update_script_ledger(dist: Path, script_definition_yaml: str) -> None:
+    """Test that unchanged script is not uploaded again to the same server, unless forced."""
+    session = SimpleNamespace(host="localhost", domain_name="Global", domain="1", generateAPIRequest=Mock())
+    script_command = ScriptCommandExecutor(script_definition_yaml)
+    script_command.zip_files()
+    assert script_command.update_script(session)
+    assert not script_command.update_script(session)
+    assert script_command.update_script(SimpleNamespace(**{**vars(session), "host": "other"}))
+    assert script_command.update_script(session, force=True)
+    script_command.script_zip.write_bytes(b"modified")
+    assert script_command.update_script(session)
+    assert session.generateAPIRequest.call_count == 4
+
+
+def test_zip_vendored_dependencies(dist: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that requirements are installed from wheelhouse into a cached layer that is merged into the script zip."""
+    src = tmp_path.joinpath("src")
+    src.mkdir()
+    src.joinpath("__main__.py").write_text("import vendored_dep")
+    src.joinpath("requirements.txt").write_text("vendored-dep==1.0\n")
+    wheelhouse = tmp_path.joinpath("wheelhouse")
+    _build_wheel(wheelhouse, "vendored_dep", "1.0")
+    script_definition_yaml = tmp_path.joinpath("script-definition.yaml")
+    script_definition = {"metadata": {"script_name": "Vendored"}, "files": {"wheelhouse": wheelhouse.as_posix()}}
+    script_definition_yaml.write_text(yaml.safe_dump(script_definition))
+    script_command = ScriptCommandExecutor(script_definition_yaml.as_posix(), src_dir=src)
+    script_command.zip_files()
+    with ZipFile(script_command.script_zip) as script_zip:
+        assert "__main__.py" in script_zip.namelist()
+        assert "vendored_dep/__init__.py" in script_zip.namelist()
+        assert "requirements.txt" not in script_zip.namelist()
+    first_zip = script_command.script_zip.read_bytes()
+    monkeypatch.setattr("subprocess.run", Mock(side_effect=AssertionError("cached layer should be reused")))
+    script_command.zip_files()
+    assert script_command.script_zip.read_bytes() == first_zip
+    assert len(list(dist.joinpath("dependencies").iterdir())) == 1
+    monkeypatch.undo()
+    _build_wheel(wheelhouse, "vendored_dep", "1.1")
+    script_command.zip_files()
+    assert len(list(dist.joinpath("dependencies").iterdir())) == 2
+
+
+def test_script_all(dist: Path, tmp_path: Path) -> None:
+    """Test that all scripts of a multiple scripts definition are zipped and uploaded over one session."""
+    src = tmp_path.joinpath("src")
+    src.mkdir()
+    for file in ["__main__.py", "setup.py", "teardown.py", "setup_data.txt"]:
+        src.joinpath(file).write_text(file)
+    script_definition_yaml = tmp_path.joinpath("scripts-definition.yaml")
+    script_definition = {
+        "metadata": {"template_author": "test"},
+        "files": {"exclude": ["teardown.py"]},
+        "scripts": [
+            {"script_name": "Setup"},
+            {"script_name": "Teardown", "files": {"exclude": ["setup*"]}},
+            {"script_name": "Main", "files": {"main": "teardown.py"}},
+        ],
+    }
+    script_definition_yaml.write_text(yaml.safe_dump(script_definition))
+    session = SimpleNamespace(host="localhost", domain_name="Global", domain="1", generateAPIRequest=Mock())
+    results = script_all([script_definition_yaml.as_posix()], jobs=2, session=session, src_dir=src.as_posix())
+    assert [(result.script_name, result.status) for result in results] == [
+        ("Setup", "uploaded"),
+        ("Teardown", "uploaded"),
+        ("Main", "uploaded"),
+    ]
+    assert session.generateAPIRequest.call_count == 3
+    with ZipFile(dist.joinpath("Setup.zip")) as script_zip:
+        assert script_zip.namelist() == ["__main__.py", "setup.py", "setup_data.txt"]
+    with ZipFile(dist.joinpath("Teardown.zip")) as script_zip:
+        assert script_zip.namelist() == ["__main__.py"]
+    with ZipFile(dist.joinpath("Main.zip")) as script_zip:
+        assert script_zip.read("__main__.py") == b"teardown.py"
+    assert src.joinpath("__main__.py").read_text() == "__main__.py"
+    results = script_all([script_definition_yaml.as_posix()], session=session, src_dir=src.as_posix())
+    assert [result.status for result in results] == ["up to date"] * 3
+    script_definition_yaml.write_text(yaml.safe_dump({**script_definition, "scripts": []}))
+    assert script_all([script_definition_yaml.as_posix()], jobs=2, session=session, src_dir=src.as_posix()) == []
+
+
+def test_upload_script(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test upload from memory and from absolute path, without changing directory, with retries on transient errors."""
+    monkeypatch.setattr("shellfoundry_traffic.script_utils.UPLOAD_BACKOFF", 0.01)
+    session = SimpleNamespace(generateAPIRequest=Mock(side_effect=[ConnectionResetError(), TimeoutError(), None]))
+    cwd = os.getcwd()
+    _, attempts = upload_script(session, "Test Script", b"zip content")
+    assert attempts == 3
+    request = session.generateAPIRequest.call_args.args[0]
+    assert request["method_name"] == "UpdateScript"
+    assert base64.b64decode(request["scriptFile"]) == b"zip content"
+    assert request["scriptFileName"] == "Test Script.zip"
+    script_zip = tmp_path.joinpath("dist", "Other.zip")
+    script_zip.parent.mkdir()
+    script_zip.write_bytes(b"file content")
+    session.generateAPIRequest = Mock()
+    assert upload_script(session, "Test Script", script_zip)[1] == 1
+    assert session.generateAPIRequest.call_args.args[0]["scriptFileName"] == "Other.zip"
+    assert os.getcwd() == cwd
+    session.generateAPIRequest = Mock(side_effect=ConnectionResetError())
+    with pytest.raises(ConnectionResetError):
+        upload_script(session, "Test Script", b"zip content", retries=2)
+    assert session.generateAPIRequest.call_count == 3
+    session.generateAPIRequest = Mock(side_effect=CloudShellAPIError(100, "Script not found", ""))
+    with pytest.raises(CloudShellAPIError):
+        upload_script(session, "Test Script", b"zip content")
+    assert session.generateAPIRequest.call_count == 1
+
+
+def test_upload_script_stand_in(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test concurrent uploads, with dropped connections, against stand-in server with latency."""
+    monkeypatch.setattr("shellfoundry_traffic.script_utils.UPLOAD_BACKOFF", 0.01)
+    clear_sessions()
+    with CloudShellStandIn(latency=0.2) as stand_in:
+        session = get_session(stand_in.host, "admin", "admin", port=stand_in.port)
+        names = [f"Script {index}" for index in range(4)]
+        stand_in.scripts.update({name: b"" for name in names})
+        stand_in.fail("UpdateScript", count=2, transient=True)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(4) as executor:
+            attempts = [
+                attempt for _, attempt in executor.map(lambda name: upload_script(session, name, name.encode()), names)
+            ]
+        assert time.perf_counter() - start < 0.2 * 4
+        assert sum(attempts) == 6
+        assert stand_in.scripts == {name: name.encode() for name in names}
+        with pytest.raises(CloudShellAPIError, match="not found"):
+            upload_script(session, "Unknown Script", b"zip content")
+    clear_sessions()
+
+
+@pytest.mark.parametrize(
+    "path, is_dir, excluded",
+    [
+        ("exclude.txt", False, True),
+        ("pkg/exclude.txt", False, True),
+        ("pkg/tests", True, True),
+        ("tests", False, False),
+        ("build", True, True),
+        ("pkg/build", True, False),
+        ("docs/a/b.md", False, True),
+        ("docs/keep.md", False, False),
+        ("a.py", False, True),
+        ("c.py", False, False),
+    ],
+)
+def test_exclude_matcher(path: str, is_dir: bool, excluded: bool) -> None:
+    """Test gitignore style exclude patterns."""
+    matcher = ExcludeMatcher(["# comment", "exclude.txt", "tests/", "/build", "docs/**/*.md", "!docs/keep.md", "[ab].py"])
+    assert matcher.match(path, is_dir) == excluded
 
 
 def _get_script_definition(script_definition: str) -> dict:
@@ -75,3 +266,18 @@ def _get_script_definition(script_definition: str) -> dict:
 def _get_script_zip(dist: Path, shell_definition_yaml: str) -> ZipFile:
     script_zip = dist.joinpath(f'{_get_script_definition(shell_definition_yaml)["metadata"]["script_name"]}.zip')
     return ZipFile(script_zip, "r")
+
+
+def _build_wheel(wheelhouse: Path, name: str, version: str) -> None:
+    """Build minimal pure python wheel."""
+    dist_info = f"{name}-{version}.dist-info"
+    files = {
+        f"{name}/__init__.py": "",
+        f"{dist_info}/METADATA": f"Metadata-Version: 2.1\nName: {name.replace('_', '-')}\nVersion: {version}\n",
+        f"{dist_info}/WHEEL": "Wheel-Version: 1.0\nGenerator: test\nRoot-Is-Purelib: true\nTag: py3-none-any\n",
+    }
+    files[f"{dist_info}/RECORD"] = "".join(f"{file},,\n" for file in files) + f"{dist_info}/RECORD,,\n"
+    wheelhouse.mkdir(parents=True, exist_ok=True)
+    with ZipFile(wheelhouse.joinpath(f"{name}-{version}-py3-none-any.whl"), "w") as wheel:
+        for file, content in files.items():
+            wheel.writestr(file, content)
@@ -3,39 +3,77 @@ Test cloudshell_traffic CLI command.
 """
 # pylint: disable=redefined-outer-name
 import importlib.util
+import json
 import os
 import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from pathlib import Path
-from typing import List
+from threading import Event, Thread
+from typing import Dict, Iterator, List
 from xml.etree import ElementTree
-from zipfile import ZipFile
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
 
 import pytest
 import yaml
 from _pytest.fixtures import SubRequest
 from cloudshell.rest.api import PackagingRestApiClient
 from cloudshell.rest.exceptions import ShellNotFoundException
+from cloudshell_stand_in import CloudShellStandIn
 from shellfoundry.utilities.config_reader import CloudShellConfigReader, Configuration
 
-from shellfoundry_traffic.shellfoundry_traffic_cmd import _get_main_class, main
-
-SHELL_FOUNDRY_TRAFFIC_TESTS = "c:/temp/shell_foundry_traffic_tests"
+from shellfoundry_traffic.shell_utils import (
+    PACK_FORMAT,
+    build_manifest,
+    changed_node_types,
+    generate_manifest,
+    merge_data_model,
+    staged_build,
+    write_generate_record,
+)
+from shellfoundry_traffic.shellfoundry_traffic_cmd import (
+    _get_main_class,
+    generate,
+    main,
+    pack,
+    watch,
+)
 
 
 @pytest.fixture
-def dist() -> Path:
-    """Yields empty dist folder."""
+def dist() -> Iterator[Path]:
+    """Yields empty dist folder, removed after the test."""
     dist = Path(__file__).parent.joinpath("dist")
     shutil.rmtree(dist, ignore_errors=True)
     os.mkdir(dist)
-    return dist
+    yield dist
+    shutil.rmtree(dist, ignore_errors=True)
+
+
+@pytest.fixture
+def stand_in(monkeypatch: pytest.MonkeyPatch) -> Iterator[CloudShellStandIn]:
+    """Yields local stand-in CloudShell server, shellfoundry config points to the stand-in."""
+    with CloudShellStandIn() as stand_in:
+        config = Configuration(CloudShellConfigReader()).read()
+        config.host, config.port = stand_in.host, stand_in.port
+        monkeypatch.setattr(Configuration, "read", lambda self: config)
+        yield stand_in
 
 
-@pytest.fixture(scope="session")
-def packaging_api() -> PackagingRestApiClient:
-    """Yields packaging API object."""
-    config = Configuration(CloudShellConfigReader()).read()
-    return PackagingRestApiClient(config.host, config.port, config.username, config.password, config.domain)
+@pytest.fixture
+def packaging_api(stand_in: CloudShellStandIn) -> PackagingRestApiClient:
+    """Yields packaging API object of the stand-in server."""
+    return PackagingRestApiClient(stand_in.host, stand_in.port, "admin", "admin", "Global")
+
+
+@pytest.fixture
+def packaging_servers() -> Iterator[Dict[str, CloudShellStandIn]]:
+    """Yields local stand-in servers by address."""
+    with CloudShellStandIn() as first, CloudShellStandIn() as second:
+        yield {f"{stand_in.host}:{stand_in.port}": stand_in for stand_in in [first, second]}
 
 
 @pytest.fixture(params=["shell-definition-1", "shell-definition-2"])
@@ -63,33 +101,287 @@ def test_sub_commands(args: List[str]) -> None:
 def test_pack(dist: Path, shell_definition_yaml: str) -> None:
     """Test pack sub command."""
     main(["--yaml", shell_definition_yaml, "pack"])
+    _verify_shell_zip(dist, shell_definition_yaml)
+
+
+def test_pack_compression(dist: Path, shell_definition_yaml: str) -> None:
+    """Test that already compressed artifacts are stored and all other entries are deflated."""
+    pack(shell_definition_yaml)
     shell_zip = _get_shell_zip(dist, shell_definition_yaml)
-    assert Path(shell_zip.filename).name == f"{_template_name(shell_definition_yaml)}.zip"
-    assert f"{shell_definition_yaml}.yaml" in shell_zip.namelist()
+    compress_types = {info.filename: info.compress_type for info in shell_zip.infolist()}
+    assert compress_types["shell-icon.png"] == ZIP_STORED
+    assert compress_types[f"{_template_name(shell_definition_yaml)}.zip"] == ZIP_STORED
+    assert compress_types[f"{shell_definition_yaml}.yaml"] == ZIP_DEFLATED
+    assert compress_types["TOSCA-Metadata/TOSCA.meta"] == ZIP_DEFLATED
     driver_zip = _get_driver_zip(dist, shell_definition_yaml)
-    driver_metadata_xml = driver_zip.read("drivermetadata.xml")
-    driver_metadata = ElementTree.fromstring(driver_metadata_xml)
-    main_class = _get_main_class(shell_definition_yaml + ".yaml")
-    assert driver_metadata.attrib["MainClass"] == main_class
-    assert driver_metadata.attrib["Name"] == main_class.split(".")[1]
+    assert not [name for name in driver_zip.namelist() if name.endswith(".pyc")]
+
+
+def test_pack_staged(dist: Path) -> None:
+    """Test that pack does not modify the working tree so multiple shell definitions can be packed concurrently."""
+    shell_definitions = ["shell-definition-1", "shell-definition-2"]
+    staged_files = [Path("TOSCA-Metadata").joinpath("TOSCA.meta"), Path("src").joinpath("drivermetadata.xml")]
+    original_content = [staged_file.read_bytes() for staged_file in staged_files]
+    pack_cmd = [sys.executable, "-m", "shellfoundry_traffic", "--yaml"]
+    processes = [subprocess.Popen(pack_cmd + [sd, "pack"]) for sd in shell_definitions]  # pylint: disable=consider-using-with
+    assert [process.wait() for process in processes] == [0] * len(shell_definitions)
+    for shell_definition in shell_definitions:
+        _verify_shell_zip(dist, shell_definition)
+    assert [staged_file.read_bytes() for staged_file in staged_files] == original_content
+
+
+def test_staged_build_threads() -> None:
+    """Test that staged builds of concurrent threads do not change each other's current directory."""
+    cwd = os.getcwd()
+
+    def staged(shell_definition: str) -> bool:
+        with staged_build(f"{shell_definition}.yaml", _get_main_class(f"{shell_definition}.yaml")) as build_root:
+            before = Path(os.getcwd()) == build_root
+            time.sleep(0.1)
+            return before and Path(os.getcwd()) == build_root
+
+    with ThreadPoolExecutor(2) as executor:
+        assert list(executor.map(staged, ["shell-definition-1", "shell-definition-2"])) == [True, True]
+    assert os.getcwd() == cwd
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["--yaml", "shell-definition-1", "--yaml", "shell-definition-2", "pack"],
+        ["--yaml", "shell-definition-[12]", "pack", "--jobs", "2"],
+    ],
+)
+def test_pack_multiple(dist: Path, capsys: pytest.CaptureFixture, args: List[str]) -> None:
+    """Test parallel pack of multiple shell definitions."""
+    main(args)
+    summary = capsys.readouterr().out
+    for shell_definition in ["shell-definition-1", "shell-definition-2"]:
+        _verify_shell_zip(dist, shell_definition)
+        assert f"{shell_definition}.yaml" in summary
+
+
+@pytest.mark.parametrize("sub_command", ["pack", "install"])
+def test_pack_no_match(dist: Path, sub_command: str) -> None:
+    """Test that glob patterns that do not match any shell definition fail with the unmatched patterns."""
+    with pytest.raises(ValueError, match=r"nomatch-1\*.yaml, nomatch-2\*.yaml"):
+        main(["--yaml", "nomatch-1*", "--yaml", "shell-definition-1", "--yaml", "nomatch-2*", sub_command])
+    assert not list(dist.iterdir())
+
+
+def test_pack_cache(dist: Path, shell_definition_yaml: str) -> None:
+    """Test that pack is skipped when the build manifest matches the pack inputs, unless forced."""
+    assert pack(shell_definition_yaml)
+    shell_zip = dist.joinpath(f"{_template_name(shell_definition_yaml)}.zip")
+    mtime = shell_zip.stat().st_mtime_ns
+    assert not pack(shell_definition_yaml)
+    assert shell_zip.stat().st_mtime_ns == mtime
+    assert pack(shell_definition_yaml, force=True)
+    _verify_shell_zip(dist, shell_definition_yaml)
+
+
+def test_build_manifest(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that the build manifest covers the pack format and every file pack reads, including all artifacts."""
+    node_type = {"artifacts": {"driver": {"file": "driver.zip"}, "deployment": {"file": "d.zip"}, "doc": {"file": "doc.txt"}}}
+    shell_definition = {"metadata": {"template_name": "Test"}, "node_types": {"vendor.Test": node_type}}
+    tmp_path.joinpath("shell-definition.yaml").write_text(yaml.safe_dump(shell_definition))
+    for input_file in ["TOSCA-Metadata/TOSCA.meta", "src/driver.py", "deployments/deployment.xml", "doc.txt"]:
+        tmp_path.joinpath(input_file).parent.mkdir(exist_ok=True)
+        tmp_path.joinpath(input_file).write_text(input_file)
+    monkeypatch.chdir(tmp_path)
+    manifest = build_manifest("shell-definition.yaml", "driver.TestDriver")
+    assert manifest["pack_format"] == PACK_FORMAT
+    assert {"src/driver.py", "deployments/deployment.xml", "doc.txt"} <= manifest.keys()
+    tmp_path.joinpath("deployments", "deployment.xml").write_text("modified")
+    assert build_manifest("shell-definition.yaml", "driver.TestDriver") != manifest
+
+
+def test_pack_profile(dist: Path, tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+    """Test that --profile prints pack phases and writes Chrome trace, including phases of worker processes."""
+    trace_json = tmp_path.joinpath("trace.json")
+    main(["--profile", "--profile-trace", trace_json.as_posix(), "--yaml", "shell-definition-[12]", "pack"])
+    phases = [line.split()[0] for line in capsys.readouterr().out.splitlines()]
+    assert phases[phases.index("phase") + 1 :][:2] == ["shellfoundry-traffic", "load"]
+    assert {"pack", "zip", "tosca", "driver"} <= set(phases)
+    events = json.loads(trace_json.read_text())["traceEvents"]
+    assert [event["name"] for event in events].count("zip driver") == 2
+
+
+def test_pack_analyze(dist: Path, capsys: pytest.CaptureFixture) -> None:
+    """Test that pack analyze reports package entries and build stages and enforces max size."""
+    main(["--yaml", "shell-definition-1", "pack", "--analyze"])
+    report_json = dist.joinpath(f"{_template_name('shell-definition-1')}.analysis.json")
+    report = json.loads(report_json.read_text())
+    assert "shell-definition-1.yaml" in [entry["name"] for entry in report["entries"]]
+    assert {"pack", "zip driver"} <= report["stages"].keys()
+    assert "stages:" in capsys.readouterr().out
+    with pytest.raises(SystemExit) as exception_info:
+        main(["--yaml", "shell-definition-1", "pack", "--analyze", "--max-size", "1"])
+    assert exception_info.value.code == 1
 
 
-def test_generate(dist: Path, shell_definition_yaml: str) -> None:
-    """Test generate sub command."""
+def test_watch(dist: Path, capsys: pytest.CaptureFixture) -> None:
+    """Test that watch builds all definitions and then rebuilds only the definition that changed."""
+    stop = Event()
+    watcher = Thread(target=watch, args=(["shell-definition-1", "shell-definition-2"], "pack", 0.1, True, stop))
+    watcher.start()
+    try:
+        _wait_for_output(capsys, ["shell-definition-1.yaml: packed", "shell-definition-2.yaml: packed"])
+        os.utime("shell-definition-2.yaml")
+        _wait_for_output(capsys, ["shell-definition-2.yaml: up to date"], ["shell-definition-1.yaml"])
+    finally:
+        stop.set()
+        watcher.join()
+    for shell_definition in ["shell-definition-1", "shell-definition-2"]:
+        _verify_shell_zip(dist, shell_definition)
+
+
+def test_watch_install(dist: Path, capsys: pytest.CaptureFixture, stand_in: CloudShellStandIn) -> None:
+    """Test that watch install does not overwrite installed official shells."""
+    shell_name = _template_name("shell-definition-1")
+    stand_in.shells[shell_name] = 0
+    stand_in.official_shells.add(shell_name)
+    stop = Event()
+    watcher = Thread(target=watch, args=(["shell-definition-1"], "install", 0.1, True, stop))
+    watcher.start()
+    try:
+        _wait_for_output(capsys, ["shell-definition-1.yaml: failed", "official shell"])
+    finally:
+        stop.set()
+        watcher.join()
+    assert stand_in.shells[shell_name] == 0
+
+
+def test_generate(
+    stand_in: CloudShellStandIn, shell_definition_yaml: str, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Test generate sub command, in a copy of the shell folder so the data model under test is not overwritten."""
+    shell = tmp_path.joinpath("shell")
+    shutil.copytree(Path(__file__).parent, shell, ignore=shutil.ignore_patterns("dist", "__pycache__"))
+    monkeypatch.chdir(shell)
+    shell.joinpath("dist").mkdir()
     main(["--yaml", shell_definition_yaml, "generate"])
-    data_model_py = Path(__file__).parent.joinpath("src").joinpath("data_model.py")
+    assert "Generate" in stand_in.requests
+    data_model_py = shell.joinpath("src").joinpath("data_model.py")
     spec = importlib.util.spec_from_file_location("data_model", data_model_py)
     data_model = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(data_model)
     assert hasattr(data_model, _template_name(shell_definition_yaml))
 
 
+def test_generate_up_to_date(dist: Path, shell_definition_yaml: str) -> None:
+    """Test that generate is skipped when the generate record matches the shell definition and the data model."""
+    pack(shell_definition_yaml)
+    shell_zip = dist.joinpath(f"{_template_name(shell_definition_yaml)}.zip")
+    manifest = generate_manifest(f"{shell_definition_yaml}.yaml")
+    write_generate_record(shell_zip, manifest, Path("src").joinpath("data_model.py"))
+    assert generate(shell_definition_yaml) == []
+
+
+def test_changed_node_types(shell_definition_yaml: str) -> None:
+    """Test which changes require full or partial generate."""
+    manifest = generate_manifest(f"{shell_definition_yaml}.yaml")
+    node_type = list(manifest["node_types"])[0]
+    assert changed_node_types(manifest, manifest) == []
+    added = {**manifest, "node_types": {**manifest["node_types"], "vendor.resource.New": "new"}}
+    assert changed_node_types(manifest, added) == ["vendor.resource.New"]
+    modified = {**manifest, "node_types": {node_type: "modified"}}
+    assert changed_node_types(manifest, modified) == [node_type]
+    assert changed_node_types(added, manifest) is None
+    assert changed_node_types(manifest, {**manifest, "imports": "modified"}) is None
+    assert changed_node_types(manifest, {**manifest, "generator": "0.0.0"}) is None
+
+
+def test_generate_manifest_standard(tmp_path: Path) -> None:
+    """Test that a changed local standard file invalidates the generate manifest, even if the import did not change."""
+    standard = tmp_path.joinpath("standard_1_0_0.yaml")
+    standard.write_text("node_types: {}")
+    shell_definition_yaml = tmp_path.joinpath("shell-definition.yaml")
+    shell_definition = {"imports": [{"cloudshell_standard": standard.name}], "node_types": {"vendor.Test": {}}}
+    shell_definition_yaml.write_text(yaml.safe_dump(shell_definition))
+    manifest = generate_manifest(shell_definition_yaml.as_posix())
+    standard.write_text("node_types: {modified: {}}")
+    modified = generate_manifest(shell_definition_yaml.as_posix())
+    assert modified["imports"] != manifest["imports"]
+    assert changed_node_types(manifest, modified) is None
+
+
+def test_merge_data_model() -> None:
+    """Test that generated classes replace existing classes with the same name and new classes are appended."""
+    existing = Path("src").joinpath("data_model.py").read_text()
+    generated = "import os\n\n\nclass ResourcePort(object):\n    pass\n\n\nclass NewResource(object):\n    pass\n"
+    merged = merge_data_model(existing, generated)
+    assert merged.startswith("import os\n\n\nclass LegacyUtils(object):")
+    assert "class ResourcePort(object):\n    pass\n\n\nclass GenericPowerPort(object):" in merged
+    assert merged.endswith("class NewResource(object):\n    pass\n")
+    assert merge_data_model(existing, existing) == existing.rstrip("\n") + "\n"
+
+
 def test_install(dist: Path, shell_definition_yaml: str, packaging_api: PackagingRestApiClient) -> None:
     """Test install sub command."""
     main(["--yaml", shell_definition_yaml, "install"])
     assert packaging_api.get_shell(_template_name(shell_definition_yaml))
 
 
+def test_install_multiple(dist: Path, tmp_path: Path, capsys: pytest.CaptureFixture, packaging_servers: dict) -> None:
+    """Test concurrent install of multiple shell definitions to multiple servers with one login per server."""
+    servers = {address: stand_in.server for address, stand_in in packaging_servers.items()}
+    servers_yaml = tmp_path.joinpath("servers.yaml")
+    servers_yaml.write_text(yaml.safe_dump({"servers": servers}))
+    main(
+        ["--yaml", "shell-definition-[12]", "install", "--servers", servers_yaml.as_posix(), "--jobs", "3", "--pack-jobs", "2"]
+    )
+    summary = capsys.readouterr().out
+    shell_names = [_template_name(shell_definition) for shell_definition in ["shell-definition-1", "shell-definition-2"]]
+    for address, stand_in in packaging_servers.items():
+        assert address in summary
+        assert stand_in.requests.count("Login") == 1
+        assert sorted(stand_in.shells) == sorted(shell_names)
+    assert summary.count("installed") == 4
+
+
+def test_install_failure(dist: Path, tmp_path: Path, capsys: pytest.CaptureFixture, stand_in: CloudShellStandIn) -> None:
+    """Test that failed install is reported and fails the command."""
+    servers_yaml = tmp_path.joinpath("servers.yaml")
+    servers_yaml.write_text(yaml.safe_dump({"servers": {"stand-in": stand_in.server}}))
+    stand_in.fail("AddShell", message="Shell is locked")
+    with pytest.raises(SystemExit) as exception_info:
+        main(["--yaml", "shell-definition-1", "install", "--servers", servers_yaml.as_posix()])
+    assert exception_info.value.code == 1
+    assert "Shell is locked" in capsys.readouterr().out
+    assert not stand_in.shells
+
+
+def test_install_official(dist: Path, tmp_path: Path, capsys: pytest.CaptureFixture, stand_in: CloudShellStandIn) -> None:
+    """Test that installed official shells are overwritten only when explicitly allowed."""
+    shell_name = _template_name("shell-definition-1")
+    stand_in.shells[shell_name] = 0
+    stand_in.official_shells.add(shell_name)
+    servers_yaml = tmp_path.joinpath("servers.yaml")
+    servers_yaml.write_text(yaml.safe_dump({"servers": {"stand-in": stand_in.server}}))
+    install_args = ["--yaml", "shell-definition-1", "install", "--servers", servers_yaml.as_posix()]
+    with pytest.raises(SystemExit):
+        main(install_args)
+    assert "official shell" in capsys.readouterr().out
+    assert stand_in.shells[shell_name] == 0
+    main(install_args + ["--allow-official"])
+    assert stand_in.shells[shell_name] > 0
+    assert shell_name not in stand_in.official_shells
+
+
+def test_install_servers(dist: Path, tmp_path: Path, capsys: pytest.CaptureFixture, stand_in: CloudShellStandIn) -> None:
+    """Test that servers outside the Global domain and servers files without servers are rejected before login."""
+    servers_yaml = tmp_path.joinpath("servers.yaml")
+    servers_yaml.write_text(yaml.safe_dump({"servers": {"stand-in": {**stand_in.server, "domain": "Test"}}}))
+    with pytest.raises(SystemExit):
+        main(["--yaml", "shell-definition-1", "install", "--servers", servers_yaml.as_posix()])
+    assert "non Global domain Test" in capsys.readouterr().out
+    assert "Login" not in stand_in.requests
+    servers_yaml.write_text(yaml.safe_dump({"servers": None}))
+    with pytest.raises(ValueError, match="No servers"):
+        main(["--yaml", "shell-definition-1", "install", "--servers", servers_yaml.as_posix()])
+
+
 def test_toska_standard(dist: Path, packaging_api: PackagingRestApiClient) -> None:
     """Test that a specific tosca standard can be installed.
 
@@ -104,6 +396,28 @@ def test_toska_standard(dist: Path, packaging_api: PackagingRestApiClient) -> No
     assert packaging_api.get_shell(_template_name(shell_definition_yaml))
 
 
+def _verify_shell_zip(dist: Path, shell_definition_yaml: str) -> None:
+    shell_zip = _get_shell_zip(dist, shell_definition_yaml)
+    assert Path(shell_zip.filename).name == f"{_template_name(shell_definition_yaml)}.zip"
+    assert f"{shell_definition_yaml}.yaml" in shell_zip.namelist()
+    driver_zip = _get_driver_zip(dist, shell_definition_yaml)
+    driver_metadata_xml = driver_zip.read("drivermetadata.xml")
+    driver_metadata = ElementTree.fromstring(driver_metadata_xml)
+    main_class = _get_main_class(shell_definition_yaml + ".yaml")
+    assert driver_metadata.attrib["MainClass"] == main_class
+    assert driver_metadata.attrib["Name"] == main_class.split(".")[1]
+
+
+def _wait_for_output(capsys: pytest.CaptureFixture, expected: List[str], unexpected: List[str] = None) -> None:
+    output = ""
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline and not all(line in output for line in expected):
+        time.sleep(0.1)
+        output += capsys.readouterr().out
+    assert all(line in output for line in expected)
+    assert not [line for line in unexpected or [] if line in output]
+
+
 def _template_name(shell_definition_yaml: str) -> str:
     tosca_meta = Path(os.getcwd()).joinpath(f"{shell_definition_yaml}.yaml")
     with open(tosca_meta, "r") as file:
@@ -122,5 +436,4 @@ def _get_driver_zip(dist: Path, shell_definition_yaml: str) -> ZipFile:
     with open(tosca_meta, "r") as file:
         shell_definition = yaml.safe_load(file)
         artifacts_driver_file = list(shell_definition["node_types"].values())[0]["artifacts"]["driver"]["file"]
-    shell_zip.extract(artifacts_driver_file, path=SHELL_FOUNDRY_TRAFFIC_TESTS)
-    return ZipFile(Path(SHELL_FOUNDRY_TRAFFIC_TESTS).joinpath(artifacts_driver_file), "r")
+    return ZipFile(BytesIO(shell_zip.read(artifacts_driver_file)), "r")
@@ -0,0 +1,56 @@
+"""
+Test analyze_utils.
+"""
+import json
+import subprocess
+import sys
+from io import BytesIO
+from pathlib import Path
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+import pytest
+
+from shellfoundry_traffic.analyze_utils import analyze_package, print_report
+
+
+def test_analyze_package(tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+    """Test sizes, duplicates (also inside nested zips) and droppable files of a package."""
+    nested = BytesIO()
+    with ZipFile(nested, "w", ZIP_DEFLATED) as nested_zip:
+        nested_zip.writestr("driver.py", "print('driver')\n" * 100)
+        nested_zip.writestr("tests/test_driver.py", "pass\n")
+    package = tmp_path.joinpath("package.zip")
+    with ZipFile(package, "w", ZIP_DEFLATED) as package_zip:
+        package_zip.writestr("driver.zip", nested.getvalue(), compress_type=ZIP_STORED)
+        package_zip.writestr("copy_of_driver.py", "print('driver')\n" * 100)
+        package_zip.writestr("README.md", "read me")
+    report = analyze_package(package, {"zip": 0.5})
+    assert report["totals"]["entries"] == 3
+    assert [entry["name"] for entry in report["entries"]][0] == "driver.zip"
+    assert report["duplicates"][0]["names"] == ["driver.zip/driver.py", "copy_of_driver.py"]
+    assert report["droppable"] == ["driver.zip/tests/test_driver.py", "README.md"]
+    driver = [entry for entry in report["entries"] if entry["name"] == "driver.py"][0]
+    assert driver["size"] == 1600 and driver["ratio"] < 0.1
+    assert json.loads(tmp_path.joinpath("package.analysis.json").read_text()) == report
+    print_report(report)
+    summary = capsys.readouterr().out
+    assert "1 duplicated, 2 droppable" in summary
+    assert "stages: zip 0.500s" in summary
+
+
+def test_analyze_package_excludes(tmp_path: Path) -> None:
+    """Test that droppable files are reported by the definition exclude rules, when there are any."""
+    package = tmp_path.joinpath("package.zip")
+    with ZipFile(package, "w", ZIP_DEFLATED) as package_zip:
+        for name in ["main.py", "tests/test_main.py", "README.md", "data/large.bin"]:
+            package_zip.writestr(name, name)
+    assert analyze_package(package, excludes=["data/", "*.md", "!README.md"])["droppable"] == ["data/large.bin"]
+    assert analyze_package(package, excludes=[])["droppable"] == ["tests/test_main.py", "README.md"]
+
+
+def test_lightweight_import() -> None:
+    """Test that analyze utilities do not import the CloudShell API or pytest (via script utilities or test helpers)."""
+    code = "import sys, shellfoundry_traffic.analyze_utils; print(' '.join(sys.modules))"
+    modules = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, check=True, text=True).stdout.split()
+    assert not [module for module in modules if module.split(".")[0] in ["cloudshell", "pytest", "_pytest"]]
+    assert "shellfoundry_traffic.script_utils" not in modules
@@ -0,0 +1,72 @@
+"""
+Test profile_utils.
+"""
+import json
+import pstats
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from shellfoundry_traffic.profile_utils import Profiler
+
+
+def test_spans(tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+    """Test that nested and concurrent spans are recorded, reported and written as Chrome trace."""
+    profiler = Profiler()
+    with profiler.span("disabled"):
+        pass
+    assert not profiler.spans
+    profiler.enable()
+    with profiler.span("command"):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(lambda _: _nested_spans(profiler), range(2)))
+    assert sorted((span.name, span.depth) for span in profiler.spans) == [
+        ("command", 0),
+        ("inner", 1),
+        ("inner", 1),
+        ("outer", 0),
+        ("outer", 0),
+    ]
+    profiler.print_table()
+    table = capsys.readouterr().out.splitlines()
+    assert [line.split()[:2] for line in table[1:]] == [["command", "1"], ["outer", "2"], ["inner", "2"]]
+    trace_json = tmp_path.joinpath("trace.json")
+    profiler.write_trace(trace_json.as_posix())
+    events = json.loads(trace_json.read_text())["traceEvents"]
+    assert len(events) == 5
+    assert min(event["ts"] for event in events) == 0
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
+
+
+def test_profile_dumps(tmp_path: Path) -> None:
+    """Test that the outermost profiled phases are dumped and nested phases are not."""
+    profiler = Profiler()
+    profiler.enable(tmp_path.joinpath("profile").as_posix())
+    with profiler.span("command", profile=False):
+        _nested_spans(profiler)
+        _nested_spans(profiler)
+    dumps = sorted(tmp_path.joinpath("profile").iterdir())
+    assert [dump.name.split("-", 1)[1] for dump in dumps] == ["001-outer.prof", "002-outer.prof"]
+    assert pstats.Stats(dumps[0].as_posix()).total_calls
+
+
+def test_record_stages() -> None:
+    """Test that stages are recorded per thread, without enabling the profiler."""
+    profiler = Profiler()
+    with profiler.record() as stages:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            executor.submit(_nested_spans, profiler).result()
+        with profiler.span("command"):
+            pass
+        _nested_spans(profiler)
+    assert list(stages) == ["command", "outer", "inner"]
+    assert all(seconds >= 0 for seconds in stages.values())
+    assert not profiler.enabled
+    assert not profiler.spans
+
+
+def _nested_spans(profiler: Profiler) -> None:
+    with profiler.span("outer"):
+        with profiler.span("inner"):
+            sum(range(1000))
@@ -0,0 +1,63 @@
+"""
+Test shellfoundry_traffic CLI command startup.
+"""
+import subprocess
+import sys
+import time
+from typing import Dict
+
+import pytest
+
+from shellfoundry_traffic.shellfoundry_traffic_cmd import get_version, main
+
+IMPORT_TIME_BUDGET = 2.0
+LAZY_PACKAGES = ["shellfoundry", "cloudshell", "pytest"]
+
+
+def test_import_time() -> None:
+    """Test that importing the CLI module stays within the startup budget."""
+    import_cmd = [sys.executable, "-c", "import shellfoundry_traffic.shellfoundry_traffic_cmd"]
+    durations = []
+    for _ in range(3):
+        start = time.perf_counter()
+        subprocess.run(import_cmd, check=True)
+        durations.append(time.perf_counter() - start)
+    assert min(durations) < IMPORT_TIME_BUDGET
+
+
+@pytest.mark.parametrize(
+    "args",
+    [None, ["-h"], ["--yaml", "shell-definition", "pack", "-h"], ["--yaml", "script-definition", "script", "-h"]],
+)
+def test_lazy_imports(args: list) -> None:
+    """Test that CLI startup and help do not import sub commands dependencies."""
+    code = "import shellfoundry_traffic.shellfoundry_traffic_cmd as cmd"
+    if args:
+        code += f"\ntry:\n    cmd.main({args})\nexcept SystemExit:\n    pass"
+    report = _import_time_report(code)
+    lazy_modules = [module for module in report if module.split(".")[0] in LAZY_PACKAGES]
+    slowest = sorted(report.items(), key=lambda item: item[1], reverse=True)[:10]
+    assert not lazy_modules, f"slowest imports (cumulative us): {slowest}"
+
+
+@pytest.mark.parametrize("args", [["-V"], ["--version"]])
+def test_version(capsys: pytest.CaptureFixture, args: list) -> None:
+    """Test that version is resolved only on request and printed to stdout."""
+    with pytest.raises(SystemExit) as exception_info:
+        main(args)
+    assert exception_info.value.code == 0
+    assert capsys.readouterr().out.strip() == get_version()
+    assert get_version() != "N/A"
+
+
+def _import_time_report(code: str) -> Dict[str, int]:
+    """Run code in a fresh interpreter and return cumulative import time, in microseconds, per imported module."""
+    import_cmd = [sys.executable, "-X", "importtime", "-c", code]
+    output = subprocess.run(import_cmd, stderr=subprocess.PIPE, check=True, text=True).stderr
+    report = {}
+    for line in output.splitlines():
+        if line.startswith("import time:"):
+            _, cumulative, module = line[len("import time:") :].split("|")
+            if cumulative.strip().isdigit():
+                report[module.strip()] = int(cumulative)
+    return report
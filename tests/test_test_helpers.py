@@ -2,19 +2,59 @@
 Test test_helpers.
 """
 # pylint: disable=redefined-outer-name
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List
+from unittest.mock import Mock
+
 import pytest
-from cloudshell.api.cloudshell_api import CloudShellAPISession
+from cloudshell.api.cloudshell_api import (
+    AttributeNameValue,
+    CloudShellAPISession,
+    UpdateTopologyGlobalInputsRequest,
+)
+from cloudshell.api.common_cloudshell_api import CloudShellAPIError
+from cloudshell_stand_in import CloudShellStandIn
 
-from shellfoundry_traffic.test_helpers import TgTestHelpers, create_session_from_config
+from shellfoundry_traffic.profile_utils import PROFILER
+from shellfoundry_traffic.test_helpers import (
+    RESERVATION_TIME_FORMAT,
+    AsyncTgTestHelpers,
+    AutoloadResource,
+    ReservationPool,
+    TgTestHelpers,
+    cleanup_reservations,
+    clear_sessions,
+    create_session_from_config,
+    end_named_reservations,
+    end_reservation,
+    end_reservations,
+    gather_reservations,
+    get_session,
+    reservation_filter,
+)
 
 RESERVATION_NAME = "testing 1 2 3"
 
 
 @pytest.fixture()
-def session() -> CloudShellAPISession:
-    """Yields CloudShell session."""
-    session = create_session_from_config()
-    return session
+def stand_in() -> Iterator[CloudShellStandIn]:
+    """Yields local stand-in CloudShell server."""
+    clear_sessions()
+    with CloudShellStandIn() as stand_in:
+        yield stand_in
+    clear_sessions()
+
+
+@pytest.fixture()
+def session(stand_in: CloudShellStandIn) -> CloudShellAPISession:
+    """Yields CloudShell session to the stand-in server."""
+    return get_session(stand_in.host, "admin", "admin", port=stand_in.port)
 
 
 @pytest.fixture()
@@ -23,6 +63,302 @@ def test_helper(session: CloudShellAPISession) -> TgTestHelpers:
     return TgTestHelpers(session)
 
 
+@pytest.fixture()
+def fake_api(monkeypatch: pytest.MonkeyPatch) -> Iterator[Dict[str, List[str]]]:
+    """Yields fake CloudShell API, logons create tokens that can be expired by the test."""
+    api: Dict[str, List[str]] = {"logons": [], "valid": [], "requests": []}
+
+    def generate_api_request(session: CloudShellAPISession, kwargs: Dict[str, Any]) -> Any:
+        method_name = kwargs.pop("method_name")
+        if method_name == "Logon":
+            token = f"token-{len(api['logons'])}"
+            api["logons"].append(token)
+            api["valid"] = [token]
+            return SimpleNamespace(Token=SimpleNamespace(Token=token), Domain=SimpleNamespace(DomainId="domain-id"))
+        if session.token_id not in api["valid"]:
+            raise CloudShellAPIError(105, "Token is invalid or expired, please login", "")
+        if method_name == "CreateResource":
+            api["requests"].append(method_name)
+            raise CloudShellAPIError(100, "Failed to log in to resource, check the token attribute", "")
+        api["requests"].append(method_name)
+        return method_name
+
+    monkeypatch.setattr(CloudShellAPISession, "generateAPIRequest", generate_api_request)
+    clear_sessions()
+    yield api
+    clear_sessions()
+
+
+def test_get_session(fake_api: Dict[str, List[str]]) -> None:
+    """Test that sessions are cached per host, user and domain and shared between threads."""
+    with ThreadPoolExecutor(8) as executor:
+        sessions = list(executor.map(lambda _: get_session("localhost", "admin", "admin"), range(16)))
+    assert all(session is sessions[0] for session in sessions)
+    assert sessions[0].domain_name == "Global"
+    assert len(fake_api["logons"]) == 1
+    assert get_session("localhost", "admin", "admin", "Other") is not sessions[0]
+    assert len(fake_api["logons"]) == 2
+
+
+def test_session_relogin(fake_api: Dict[str, List[str]]) -> None:
+    """Test that requests with expired token log in again, once for all threads, and are resent."""
+    session = get_session("localhost", "admin", "admin")
+    assert session.GetServerDateAndTime() == "GetServerDateAndTime"
+    fake_api["valid"] = []
+    with ThreadPoolExecutor(4) as executor:
+        responses = list(executor.map(lambda _: session.GetServerDateAndTime(), range(8)))
+    assert responses == ["GetServerDateAndTime"] * 8
+    assert len(fake_api["logons"]) == 2
+    assert session.token_id == "token-1"
+    fake_api["valid"] = ["unknown"]
+    session.relogin()
+    assert session.token_id == "token-2"
+    with pytest.raises(CloudShellAPIError, match="token attribute"):
+        session.CreateResource("Generic Chassis", "resource", "na")
+    assert fake_api["requests"].count("CreateResource") == 1
+    assert len(fake_api["logons"]) == 3
+
+
+def test_session_from_config(fake_api: Dict[str, List[str]], tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that the session from shellfoundry config is cached until the config file changes."""
+    monkeypatch.chdir(tmp_path)
+    config_yaml = tmp_path.joinpath("cloudshell_config.yml")
+    config_yaml.write_text("install:\n  host: host-1\n")
+    session = create_session_from_config()
+    assert session.host == "host-1"
+    assert create_session_from_config() is session
+    config_yaml.write_text("install:\n  host: host-2\n")
+    os.utime(config_yaml, ns=(0, config_yaml.stat().st_mtime_ns + 1))
+    other_session = create_session_from_config()
+    assert other_session.host == "host-2"
+    assert len(fake_api["logons"]) == 2
+
+
+def test_get_session_per_server(stand_in: CloudShellStandIn) -> None:
+    """Test that a slow login to one server does not block getting sessions to other servers."""
+    stand_in.latencies["Logon"] = 1
+    with CloudShellStandIn() as other_stand_in, ThreadPoolExecutor(1) as executor:
+        slow_session = executor.submit(get_session, stand_in.host, "admin", "admin", port=stand_in.port)
+        while "Logon" not in stand_in.requests:
+            time.sleep(0.01)
+        assert get_session(other_stand_in.host, "admin", "admin", port=other_stand_in.port)
+        assert not slow_session.done()
+        assert slow_session.result() is get_session(stand_in.host, "admin", "admin", port=stand_in.port)
+    assert stand_in.requests.count("Logon") == 1
+
+
+def test_create_autoload_resource(
+    stand_in: CloudShellStandIn, session: CloudShellAPISession, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Test that create_autoload_resource looks up the resource by exact name instead of scanning all resources."""
+    for index in range(20):
+        stand_in.add_resource(f"resource-{index}", folder="Testing")
+    test_helpers = TgTestHelpers(session)
+    find_resources = Mock(wraps=session.FindResources)
+    monkeypatch.setattr(session, "FindResources", find_resources)
+    resource = test_helpers.create_autoload_resource("Generic Chassis", "Testing/resource-1", "1.2.3.4")
+    assert resource.Name == "resource-1"
+    find_resources.assert_called_once_with(resourceFullName="resource-1", exactName=True, includeSubResources=False)
+    assert stand_in.requests[-4:] == ["FindResources", "DeleteResource", "CreateResource", "UpdateResourceDriver"]
+    assert len(stand_in.resources) == 20
+    test_helpers.create_autoload_resource("Generic Chassis", "Testing/new-resource")
+    assert stand_in.requests.count("DeleteResource") == 1
+    assert "new-resource" in stand_in.resources
+    assert "GetResourceList" not in stand_in.requests
+
+
+def test_create_autoload_resources(stand_in: CloudShellStandIn, session: CloudShellAPISession) -> None:
+    """Test that bulk provisioning deletes existing resources and sets all attributes with single requests."""
+    for index in range(5):
+        stand_in.add_resource(f"resource-{index}", folder="Testing")
+    resources = [
+        AutoloadResource(
+            "Generic Chassis", f"Testing/resource-{index}", f"1.2.3.{index}", [AttributeNameValue("User", "admin")]
+        )
+        for index in range(20)
+    ]
+    stand_in.requests.clear()
+    PROFILER.enable()
+    try:
+        provision = TgTestHelpers(session).create_autoload_resources(resources)
+        assert PROFILER.enabled
+        assert not PROFILER.collect()
+    finally:
+        PROFILER.disable()
+    assert [resource.Name for resource in provision.resources] == [Path(resource.full_name).name for resource in resources]
+    assert list(provision.stages) == ["find resources", "delete resources", "create resources", "set attributes"]
+    for operation, count in [
+        ("FindResources", 20),
+        ("DeleteResources", 1),
+        ("CreateResource", 20),
+        ("SetAttributesValues", 1),
+    ]:
+        assert stand_in.requests.count(operation) == count
+    assert len(stand_in.resources) == 20
+    assert all(resource["attributes"] == {"User": "admin"} for resource in stand_in.resources.values())
+
+
+def test_stand_in_teardown(stand_in: CloudShellStandIn, session: CloudShellAPISession) -> None:
+    """Test teardown polling, concurrent cleanup, injected failures and re-login against stand-in with latency."""
+    stand_in.latency = 0.01
+    stand_in.teardown_seconds = 0.5
+    test_helper = TgTestHelpers(session)
+    test_helper.create_reservation(RESERVATION_NAME)
+    stand_in.requests.clear()
+    assert 0.5 <= test_helper.end_reservation() < 1.5
+    assert stand_in.requests.count("GetReservationStatus") <= 6
+
+    for index in range(8):
+        test_helper.create_reservation(f"{RESERVATION_NAME} {index}")
+    stand_in.fail("EndReservation")
+    stand_in.expire_tokens()
+    stand_in.requests.clear()
+    cleanup = cleanup_reservations(session, reservation_filter(name=f"{RESERVATION_NAME} *"))
+    assert len(cleanup.results) == 8
+    assert len(cleanup.errors) == 1
+    assert "Injected failure" in cleanup.errors[0].error
+    assert cleanup.seconds < 0.5 * 4
+    assert stand_in.requests.count("Logon") == 1
+    assert len(stand_in.reservations) == 1
+
+
+def reservation_session(statuses: List[str]) -> SimpleNamespace:
+    """Returns fake session, GetReservationStatus returns the statuses, then Completed."""
+    status_infos = [
+        SimpleNamespace(ReservationSlimStatus=SimpleNamespace(Status=status)) for status in statuses + ["Completed"]
+    ]
+    return SimpleNamespace(
+        EndReservation=Mock(), GetReservationStatus=Mock(side_effect=status_infos), DeleteReservation=Mock()
+    )
+
+
+def test_end_reservation() -> None:
+    """Test that end_reservation polls status until teardown completes, then deletes the reservation."""
+    session = reservation_session(["Started", "Teardown", "Teardown"])
+    seconds = end_reservation(session, "id", interval=0.01)
+    assert 0.01 + 0.015 + 0.0225 <= seconds < 1
+    session.EndReservation.assert_called_once_with("id")
+    assert session.GetReservationStatus.call_count == 4
+    session.DeleteReservation.assert_called_once_with("id")
+
+
+def test_end_reservation_failures() -> None:
+    """Test that end_reservation surfaces teardown timeout and API errors."""
+    session = reservation_session(["Teardown"] * 100)
+    with pytest.raises(TimeoutError, match="reservation id teardown"):
+        end_reservation(session, "id", timeout=0.1, interval=0.01)
+    session.DeleteReservation.assert_not_called()
+    session = reservation_session([])
+    session.EndReservation.side_effect = CloudShellAPIError(100, "Reservation not found", "")
+    with pytest.raises(CloudShellAPIError):
+        end_reservation(session, "id")
+
+
+def reservations_session(names: List[str], teardown: float) -> SimpleNamespace:
+    """Returns fake session with current reservations, each teardown takes teardown seconds."""
+    start_time = (datetime.now(timezone.utc) - timedelta(hours=1)).strftime(RESERVATION_TIME_FORMAT)
+    reservations = [
+        SimpleNamespace(Id=f"id-{index}", Name=name, Owner="admin", StartTime=start_time) for index, name in enumerate(names)
+    ]
+    return SimpleNamespace(
+        username="admin",
+        GetCurrentReservations=Mock(return_value=SimpleNamespace(Reservations=reservations)),
+        EndReservation=Mock(side_effect=lambda reservation_id: time.sleep(teardown)),
+        GetReservationStatus=Mock(return_value=SimpleNamespace(ReservationSlimStatus=SimpleNamespace(Status="Completed"))),
+        DeleteReservation=Mock(),
+    )
+
+
+def test_cleanup_reservations() -> None:
+    """Test that matching reservations are ended concurrently and failures are reported per reservation."""
+    session = reservations_session([RESERVATION_NAME] * 8 + ["other"], 0.2)
+
+    def delete_reservation(reservation_id: str) -> None:
+        if reservation_id == "id-0":
+            raise CloudShellAPIError(100, "Reservation is locked", "")
+
+    session.DeleteReservation.side_effect = delete_reservation
+    cleanup = cleanup_reservations(session, reservation_filter(name="testing*", older_than=60))
+    assert len(cleanup.results) == 8
+    assert cleanup.seconds < 0.2 * 4
+    assert [result.reservation_id for result in cleanup.errors] == ["id-0"]
+    assert "Reservation is locked" in cleanup.errors[0].error
+    assert not cleanup_reservations(session, reservation_filter(owner="other")).results
+    assert not cleanup_reservations(session, reservation_filter(older_than=3 * 60 * 60)).results
+    with pytest.raises(RuntimeError, match="id-0"):
+        end_named_reservations(session, RESERVATION_NAME)
+
+
+def test_gather_reservations() -> None:
+    """Test that reservations are created and ended concurrently."""
+    session = reservations_session([], 0.2)
+
+    def create_reservation(reservation_name: str, *_: Any, **__: Any) -> SimpleNamespace:
+        time.sleep(0.2)
+        if reservation_name == "fail":
+            raise CloudShellAPIError(100, "No license", "")
+        return SimpleNamespace(Reservation=SimpleNamespace(Id=f"id-{reservation_name}"))
+
+    session.CreateImmediateReservation = Mock(side_effect=create_reservation)
+
+    async def gather() -> List[AsyncTgTestHelpers]:
+        helpers = await gather_reservations(session, ["1", "2", "3", "4"])
+        assert [helper.reservation_id for helper in helpers] == ["id-1", "id-2", "id-3", "id-4"]
+        await end_reservations(helpers)
+        return helpers
+
+    start = time.monotonic()
+    helpers = asyncio.run(gather())
+    assert time.monotonic() - start < 0.2 * 4
+    assert not [helper.reservation_id for helper in helpers if helper.reservation_id]
+    assert session.DeleteReservation.call_count == 4
+
+    with pytest.raises(CloudShellAPIError, match="No license"):
+        asyncio.run(gather_reservations(session, ["5", "fail"]))
+    session.DeleteReservation.assert_called_with("id-5")
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(AsyncTgTestHelpers(session).create_reservation("6", timeout=0.05))
+
+
+def test_reservation_pool(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that pool reservations are reused per topology and ended on close, and reservations are named per worker."""
+    monkeypatch.setenv("PYTEST_XDIST_WORKER", "gw1")
+    session = reservations_session([], 0)
+    created = []
+
+    def create_reservation(reservation_name: str, *_: Any, **__: Any) -> SimpleNamespace:
+        created.append(reservation_name)
+        return SimpleNamespace(Reservation=SimpleNamespace(Id=f"id-{reservation_name}"))
+
+    session.CreateImmediateReservation = Mock(side_effect=create_reservation)
+    session.CreateImmediateTopologyReservation = Mock(side_effect=create_reservation)
+    resets = []
+    pool = ReservationPool(session, reset=lambda helpers: resets.append(helpers.reservation_id))
+    pool.warm(2)
+    assert created == ["tg regression tests gw1 1", "tg regression tests gw1 2"]
+    with pool.lease() as first:
+        with pool.lease() as second:
+            assert first.reservation_id != second.reservation_id
+    with pool.lease() as third:
+        assert third.reservation_id in [first.reservation_id, second.reservation_id]
+    assert len(created) == 2
+    assert len(resets) == 3
+    with pool.lease("topology", [UpdateTopologyGlobalInputsRequest("speed", "10G")]):
+        pass
+    with pool.lease("topology", [UpdateTopologyGlobalInputsRequest("speed", "10G")]):
+        pass
+    assert len(created) == 3
+    pool.reset = Mock(side_effect=RuntimeError("dirty"))
+    with pytest.raises(RuntimeError, match="dirty"):
+        with pool.lease():
+            pass
+    assert session.DeleteReservation.call_count == 1
+    assert len(pool.close()) == 2
+    assert session.DeleteReservation.call_count == 3
+    TgTestHelpers(session).create_reservation()
+    assert created[-1] == "tg regression tests gw1"
+
+
 def verify_reservation(test_helper: TgTestHelpers) -> None:
     """Verify that reservation was created successfully."""
     reservations = test_helper.session.GetCurrentReservations(reservationOwner=test_helper.session.username)
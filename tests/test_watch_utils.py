@@ -0,0 +1,42 @@
+"""
+Test watch_utils.
+"""
+# pylint: disable=redefined-outer-name
+import time
+from pathlib import Path
+from threading import Timer
+
+import pytest
+from _pytest.fixtures import SubRequest
+
+from shellfoundry_traffic.watch_utils import ChangeWatcher
+
+
+@pytest.fixture(params=[True, False], ids=["polling", "watchdog"])
+def polling(request: SubRequest) -> bool:
+    """Yields whether to poll or to use watchdog."""
+    if not request.param:
+        pytest.importorskip("watchdog")
+    return request.param
+
+
+def test_debounce(tmp_path: Path, polling: bool) -> None:
+    """Test that a burst of changes is reported once, and that changes under __pycache__ are ignored."""
+    src = tmp_path.joinpath("src")
+    src.joinpath("__pycache__").mkdir(parents=True)
+    definition = tmp_path.joinpath("definition.yaml")
+    definition.write_text("metadata:")
+    watcher = ChangeWatcher([src, definition], debounce=0.3, poll_interval=0.05, polling=polling)
+    try:
+        assert not watcher.wait(timeout=0.2)
+        for index in range(3):
+            src.joinpath(f"module_{index}.py").write_text(f"index = {index}")
+            time.sleep(0.05)
+        src.joinpath("__pycache__", "module_0.cpython.pyc").write_bytes(b"")
+        Timer(0.1, definition.write_text, ["metadata: {}"]).start()
+        changes = watcher.wait(timeout=2)
+        expected = {src.joinpath(f"module_{index}.py").resolve() for index in range(3)} | {definition.resolve()}
+        assert changes == expected
+        assert not watcher.wait(timeout=0.5)
+    finally:
+        watcher.stop()